@@ -0,0 +1,111 @@
+"""CV document parsers run inside the extraction worker processes.
+
+Workers import only this module, so it must stay free of side effects: no database clients,
+no app objects and no settings read at import time. Limits are passed in by the caller.
+"""
+import io
+import re
+import time
+import logging
+from typing import Dict, Any
+
+import PyPDF2
+import docx
+import docx2txt
+
+logger = logging.getLogger(__name__)
+
+def iter_pdf_pages(pdf_reader, start: int, end: int):
+    """Yield (page_number, text, seconds) for pages [start, end) of an open PdfReader"""
+    for page_number in range(start, end):
+        started = time.perf_counter()
+        try:
+            text = pdf_reader.pages[page_number].extract_text() or ""
+        except Exception as e:
+            logger.error(f"PDF page {page_number + 1} extraction error: {e}")
+            text = ""
+        yield page_number, text, time.perf_counter() - started
+
+def collect_pdf_pages(pdf_reader, start: int, end: int, max_chars: int) -> Dict[str, Any]:
+    """Collect pages [start, end) separated by form feeds, stopping once max_chars is reached"""
+    parts = []
+    timings = []
+    chars = 0
+    for page_number, text, seconds in iter_pdf_pages(pdf_reader, start, end):
+        parts.append(text)
+        timings.append({"page": page_number + 1, "chars": len(text), "ms": round(seconds * 1000, 1)})
+        chars += len(text)
+        if chars >= max_chars:
+            break
+    return {"text": "\f".join(parts), "pages": timings}
+
+def open_upload_source(source):
+    """Open an upload source (in-memory bytes or a spooled file path) as a seekable binary handle"""
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+def extract_pdf_pages(source, start: int, end: int, max_chars: int) -> Dict[str, Any]:
+    """Extract one page range of a PDF"""
+    try:
+        with open_upload_source(source) as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            page_count = len(pdf_reader.pages)
+            result = collect_pdf_pages(pdf_reader, start, min(end, page_count), max_chars)
+        result["page_count"] = page_count
+        return result
+    except Exception as e:
+        logger.error(f"PDF extraction error: {e}")
+        return {"text": "", "pages": [], "page_count": 0}
+
+def extract_text_from_docx(docx_file) -> str:
+    """Extract text from uploaded DOCX file"""
+    try:
+        doc = docx.Document(docx_file)
+        text = ""
+        for paragraph in doc.paragraphs:
+            text += paragraph.text + "\n"
+        return text
+    except Exception as e:
+        logger.error(f"DOCX extraction error: {e}")
+        return ""
+
+def extract_text_from_doc(doc_file) -> str:
+    """Extract text from uploaded DOC file"""
+    try:
+        # Reset file pointer to beginning
+        doc_file.seek(0)
+        text = docx2txt.process(doc_file)
+        return text if text else ""
+    except Exception as e:
+        logger.error(f"DOC extraction error: {e}")
+        # Try alternative approach - treat as binary and extract readable text
+        try:
+            doc_file.seek(0)
+            content = doc_file.read()
+            # Simple text extraction for basic DOC files
+            text = content.decode('utf-8', errors='ignore')
+            # Clean up the text
+            text = re.sub(r'[\x00-\x1f\x7f-\x9f]', ' ', text)  # Remove control characters
+            text = ' '.join(text.split())  # Normalize whitespace
+            return text if len(text) > 50 else ""  # Only return if we got substantial text
+        except Exception as e2:
+            logger.error(f"Alternative DOC extraction error: {e2}")
+            return ""
+
+def extract_text_from_source(source, file_type: str) -> str:
+    """Run the DOCX or DOC parser over an upload source; PDFs go through extract_pdf_pages"""
+    parsers = {"docx": extract_text_from_docx, "doc": extract_text_from_doc}
+    if file_type not in parsers:
+        raise ValueError(f"No parser for file type: {file_type}")
+    with open_upload_source(source) as document:
+        return parsers[file_type](document)
+
+def limit_extraction_memory(limit_mb: int):
+    """Extraction worker initializer: cap the worker's address space so one file can't exhaust RAM"""
+    if limit_mb <= 0:
+        return
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not apply extraction memory limit: {e}")
@@ -1,7 +1,8 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, Tuple, Literal, Callable, Awaitable
 import os
 import openai
 import anthropic
@@ -17,14 +18,26 @@ import requests
 from bs4 import BeautifulSoup
 import re
 from datetime import datetime, timedelta
-import PyPDF2
-import docx
-import docx2txt
-import io
 import uuid
-from pymongo import MongoClient
+import hashlib
+import copy
+import time
+import random
+from collections import OrderedDict, deque
+from pymongo import MongoClient, ReturnDocument
+from bson import ObjectId
 import logging
 import asyncio
+import contextvars
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import httpx
+import aiohttp
+
+from document_parsers import extract_pdf_pages, extract_text_from_source, limit_extraction_memory
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +45,128 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Upload limits: bodies over the limit are rejected with 413 before they are buffered
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# Allowance for multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+BATCH_UPLOAD_MAX_BYTES = int(os.environ.get('BATCH_UPLOAD_MAX_BYTES', str(100 * 1024 * 1024)))
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(
+            status_code=413,
+            detail=f"File too large. The maximum upload size is {round(limit / (1024 * 1024), 1):g}MB."
+        )
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware that caps request bodies on upload routes.
+
+    A declared Content-Length over the limit is rejected before any body is read; otherwise
+    the body is counted as it streams in and the request fails with 413 once it passes the limit.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            error = UploadTooLarge(limit - MULTIPART_OVERHEAD_BYTES)
+            body = json.dumps({"detail": error.detail}).encode('utf-8')
+            await send({
+                "type": "http.response.start",
+                "status": error.status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # An HTTPException passes through FastAPI's body parsing and renders as a 413
+                    raise UploadTooLarge(limit - MULTIPART_OVERHEAD_BYTES)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+class SpooledUpload:
+    """A multipart upload read in place from the SpooledTemporaryFile Starlette parsed it into.
+
+    Starlette keeps each file part in memory up to 1MB and rolls it to disk beyond that, so the
+    SHA-256 and size are computed over that file in one chunked pass and parsers get either the
+    bytes of an in-memory part or a path to the rolled-over one. Nothing is copied into a second
+    buffer, and the form closes the file once the request is done.
+    """
+
+    def __init__(self, file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = None
+
+    @classmethod
+    async def from_upload(cls, file: UploadFile, **kwargs) -> "SpooledUpload":
+        upload = cls(file, **kwargs)
+        await upload.scan()
+        return upload
+
+    async def scan(self):
+        """Hash and size-check the upload, raising UploadTooLarge past max_bytes"""
+        hasher = hashlib.sha256()
+        await self.file.seek(0)
+        while True:
+            chunk = await self.file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise UploadTooLarge(self.max_bytes)
+            hasher.update(chunk)
+        await self.file.seek(0)
+        self.sha256 = hasher.hexdigest()
+
+    @property
+    def source(self):
+        """What the parsers open: the bytes of an in-memory part, or a path to the rolled-over file"""
+        spooled = self.file.file
+        if getattr(spooled, "_rolled", False):
+            name = spooled._file.name
+            if isinstance(name, str):
+                return name
+            # An unnamed temp file (the POSIX default) is still reachable through our descriptor
+            fd_path = f"/proc/{os.getpid()}/fd/{name}"
+            if os.path.exists(fd_path):
+                return fd_path
+        return self.read_bytes()
+
+    def read_bytes(self) -> bytes:
+        self.file.file.seek(0)
+        try:
+            return self.file.file.read()
+        finally:
+            self.file.file.seek(0)
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        "/api/upload-cv": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES,
+        "/api/analyze-cv/batch": BATCH_UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES
+    }
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -41,51 +176,1386 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# MongoDB data access settings
+# MONGO_URL=memory:// swaps MongoDB for an in-process stand-in (tests, local development)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+# Threads that run pymongo calls; keep at or below the pool size so no call waits twice
+MONGO_EXECUTOR_WORKERS = int(os.environ.get('MONGO_EXECUTOR_WORKERS', '16'))
+
+class InMemoryCollection:
+    """Thread-safe in-process stand-in for the subset of pymongo's Collection API the app uses"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _get(doc: Dict[str, Any], key: str):
+        for part in key.split('.'):
+            if not isinstance(doc, dict) or part not in doc:
+                return None
+            doc = doc[part]
+        return doc
+
+    @staticmethod
+    def _set(doc: Dict[str, Any], key: str, value: Any):
+        parts = key.split('.')
+        for part in parts[:-1]:
+            doc = doc.setdefault(part, {})
+        doc[parts[-1]] = value
+
+    @classmethod
+    def _matches(cls, doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+        for key, condition in query.items():
+            if key == "$or":
+                if not any(cls._matches(doc, sub) for sub in condition):
+                    return False
+                continue
+            value = cls._get(doc, key)
+            if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+                for op, operand in condition.items():
+                    if op == "$exists":
+                        ok = (value is not None) == operand
+                    elif op == "$ne":
+                        ok = value != operand
+                    elif op == "$in":
+                        ok = value in operand
+                    elif value is None:
+                        ok = False
+                    elif op == "$gt":
+                        ok = value > operand
+                    elif op == "$gte":
+                        ok = value >= operand
+                    elif op == "$lt":
+                        ok = value < operand
+                    elif op == "$lte":
+                        ok = value <= operand
+                    else:
+                        raise ValueError(f"Unsupported query operator: {op}")
+                    if not ok:
+                        return False
+            elif value != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        doc = copy.deepcopy(doc)
+        if projection:
+            for key, include in projection.items():
+                if not include:
+                    doc.pop(key, None)
+        return doc
+
+    def _apply_update(self, doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+        for key, value in update.get("$set", {}).items():
+            self._set(doc, key, copy.deepcopy(value))
+        for key, value in update.get("$inc", {}).items():
+            self._set(doc, key, (self._get(doc, key) or 0) + value)
+        if inserting:
+            for key, value in update.get("$setOnInsert", {}).items():
+                self._set(doc, key, copy.deepcopy(value))
+
+    def _upsert_doc(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        doc = {"_id": ObjectId()}
+        for key, value in query.items():
+            if not key.startswith('$') and not isinstance(value, dict):
+                self._set(doc, key, value)
+        return doc
+
+    def create_index(self, keys, **kwargs):
+        return keys if isinstance(keys, str) else "_".join(f"{k}_{d}" for k, d in keys)
+
+    def insert_one(self, document: Dict[str, Any]):
+        with self.lock:
+            document.setdefault("_id", ObjectId())
+            self.docs.append(copy.deepcopy(document))
+
+    def find_one(self, query: Dict[str, Any] = None, projection: Dict[str, Any] = None):
+        with self.lock:
+            for doc in self.docs:
+                if self._matches(doc, query or {}):
+                    return self._project(doc, projection)
+        return None
+
+    def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False):
+        with self.lock:
+            for doc in self.docs:
+                if self._matches(doc, query):
+                    self._apply_update(doc, update)
+                    return
+            if upsert:
+                doc = self._upsert_doc(query)
+                self._apply_update(doc, update, inserting=True)
+                self.docs.append(doc)
+
+    def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any], sort=None,
+                            projection: Dict[str, Any] = None, return_document=ReturnDocument.BEFORE):
+        with self.lock:
+            matches = [doc for doc in self.docs if self._matches(doc, query)]
+            # Apply sort keys from least to most significant; list.sort is stable
+            for key, direction in reversed(sort or []):
+                matches.sort(key=lambda d: self._get(d, key), reverse=direction < 0)
+            if not matches:
+                return None
+            doc = matches[0]
+            before = self._project(doc, projection)
+            self._apply_update(doc, update)
+            return self._project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    def delete_one(self, query: Dict[str, Any]):
+        with self.lock:
+            for i, doc in enumerate(self.docs):
+                if self._matches(doc, query):
+                    del self.docs[i]
+                    return
+
+class AsyncCollection:
+    """Non-blocking facade over a pymongo (or in-memory) collection.
+
+    Every call runs on a bounded thread pool so a database round-trip never stalls the event loop.
+    """
+
+    def __init__(self, collection, executor: ThreadPoolExecutor):
+        self.collection = collection
+        self.executor = executor
+
+    async def _run(self, method: str, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(getattr(self.collection, method), *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+    async def create_index(self, keys, **kwargs):
+        return await self._run("create_index", keys, **kwargs)
+
+    async def insert_one(self, document: Dict[str, Any]):
+        return await self._run("insert_one", document)
+
+    async def find_one(self, query: Dict[str, Any] = None, projection: Dict[str, Any] = None):
+        return await self._run("find_one", query, projection)
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False):
+        return await self._run("update_one", query, update, upsert=upsert)
+
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any], **kwargs):
+        return await self._run("find_one_and_update", query, update, **kwargs)
+
+    async def delete_one(self, query: Dict[str, Any]):
+        return await self._run("delete_one", query)
+
+class Database:
+    """Hands out AsyncCollections backed by MongoDB, or by in-memory collections for memory:// URLs"""
+
+    def __init__(self, mongo_url: str, name: str):
+        self.executor = ThreadPoolExecutor(max_workers=MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+        self.in_memory = mongo_url.startswith("memory://")
+        self.client = None
+        if not self.in_memory:
+            self.client = MongoClient(
+                mongo_url,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS
+            )
+            self.db = self.client[name]
+        self.collections = {}
+
+    def collection(self, name: str) -> AsyncCollection:
+        if name not in self.collections:
+            backend = InMemoryCollection(name) if self.in_memory else self.db[name]
+            self.collections[name] = AsyncCollection(backend, self.executor)
+        return self.collections[name]
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.executor.shutdown(wait=False)
+
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(mongo_url)
-db = client.jobprep_ai
-users_collection = db.users
-analyses_collection = db.analyses
-companies_collection = db.companies
+database = Database(mongo_url, "jobprep_ai")
+users_collection = database.collection("users")
+analyses_collection = database.collection("analyses")
+companies_collection = database.collection("companies")
+llm_cache_collection = database.collection("llm_cache")
+jobs_collection = database.collection("jobs")
+extracted_texts_collection = database.collection("extracted_texts")
 
 # AI API setup
 openai.api_key = os.environ.get('OPENAI_API_KEY')
 
-# Initialize real Anthropic client
-anthropic_client = anthropic.Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
+# Shared provider connection pool settings
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_MAX_KEEPALIVE_CONNECTIONS', '20'))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', '30'))
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', '10'))
+LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT', '120'))
+
+# Per-provider rate limits; each provider's calls share one limiter across the whole process
+OPENAI_RPM_LIMIT = int(os.environ.get('OPENAI_RPM_LIMIT', '500'))
+OPENAI_TPM_LIMIT = int(os.environ.get('OPENAI_TPM_LIMIT', '150000'))
+ANTHROPIC_RPM_LIMIT = int(os.environ.get('ANTHROPIC_RPM_LIMIT', '50'))
+ANTHROPIC_TPM_LIMIT = int(os.environ.get('ANTHROPIC_TPM_LIMIT', '40000'))
+# Starting concurrency per provider; 0 derives it from the RPM quota and a typical call latency
+LLM_INITIAL_CONCURRENCY = int(os.environ.get('LLM_INITIAL_CONCURRENCY', '0'))
+LLM_TYPICAL_LATENCY_SECONDS = float(os.environ.get('LLM_TYPICAL_LATENCY_SECONDS', '20'))
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '64'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '4'))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get('LLM_BACKOFF_BASE_SECONDS', '1'))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get('LLM_BACKOFF_MAX_SECONDS', '60'))
+# Congestion signal: the median of the last LLM_LATENCY_RECENT_CALLS calls exceeding this multiple
+# of the median over the last LLM_LATENCY_WINDOW calls. Single slow calls are mostly long outputs.
+LLM_LATENCY_BACKOFF_RATIO = float(os.environ.get('LLM_LATENCY_BACKOFF_RATIO', '2.0'))
+LLM_LATENCY_WINDOW = int(os.environ.get('LLM_LATENCY_WINDOW', '100'))
+LLM_LATENCY_RECENT_CALLS = int(os.environ.get('LLM_LATENCY_RECENT_CALLS', '10'))
+
+class TokenBucket:
+    """Refills continuously at capacity_per_minute / 60 per second, holding at most one minute's quota"""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = float(capacity_per_minute)
+        self.rate = capacity_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # Requests larger than the bucket wait for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def drain(self):
+        """Empty the bucket after the provider reports the quota exhausted"""
+        self._refill()
+        self.tokens = 0.0
+
+def initial_concurrency(rpm: int) -> int:
+    """LLM_INITIAL_CONCURRENCY, or the concurrency the RPM quota sustains at typical latency"""
+    if LLM_INITIAL_CONCURRENCY > 0:
+        return min(LLM_INITIAL_CONCURRENCY, LLM_MAX_CONCURRENCY)
+    return max(1, min(LLM_MAX_CONCURRENCY, round(rpm * LLM_TYPICAL_LATENCY_SECONDS / 60)))
+
+class AdaptiveConcurrencyLimit:
+    """AIMD concurrency limit: grows by about one per window of successes, halves on a 429,
+    and shrinks by 10% when recent calls run well above their usual median latency"""
+
+    def __init__(self, initial: int, maximum: int = LLM_MAX_CONCURRENCY, minimum: int = 1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.recent = deque(maxlen=LLM_LATENCY_RECENT_CALLS)
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @staticmethod
+    def _median(values) -> float:
+        ordered = sorted(values)
+        return ordered[len(ordered) // 2]
+
+    def on_success(self, latency: float):
+        self.latencies.append(latency)
+        self.recent.append(latency)
+        congested = (
+            len(self.recent) == self.recent.maxlen
+            and len(self.latencies) >= 2 * self.recent.maxlen
+            and self._median(self.recent) > self._median(self.latencies) * LLM_LATENCY_BACKOFF_RATIO
+        )
+        if congested:
+            self.limit = max(self.minimum, self.limit * 0.9)
+            self.recent.clear()  # one decrease per window of slow calls
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+def provider_error_info(error: Exception) -> Tuple[bool, bool, Optional[float]]:
+    """Classify a provider exception as (retryable, rate_limited, retry_after_seconds)"""
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None) or {}
+    retry_after = None
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header) if hasattr(headers, 'get') else None
+        if value is not None:
+            try:
+                retry_after = float(value) * scale
+                break
+            except ValueError:
+                pass  # HTTP-date form; fall back to our own backoff
+
+    rate_limited = status == 429 or isinstance(error, (openai.error.RateLimitError, anthropic.RateLimitError))
+    transient = (
+        (status is not None and status >= 500)
+        or isinstance(error, (
+            openai.error.ServiceUnavailableError, openai.error.APIConnectionError, openai.error.Timeout,
+            openai.error.TryAgain, anthropic.APIConnectionError, anthropic.InternalServerError,
+            asyncio.TimeoutError, aiohttp.ClientError, httpx.TransportError
+        ))
+    )
+    return rate_limited or transient, rate_limited, retry_after
+
+class AttemptTimeout(Exception):
+    """A provider request did not answer within the caller's per-attempt timeout"""
+
+async def timed_request(func: Callable[[], Awaitable[Any]], timeout: Optional[float] = None,
+                        timing: Optional[Dict[str, float]] = None) -> Any:
+    """Await one provider request within timeout, storing how long it took in timing["seconds"]"""
+    started = time.monotonic()
+    try:
+        return await (func() if timeout is None else asyncio.wait_for(func(), timeout))
+    except asyncio.TimeoutError:
+        if timeout is not None and time.monotonic() - started >= timeout:
+            raise AttemptTimeout(f"No response within {timeout:.0f}s") from None
+        raise
+    finally:
+        if timing is not None:
+            timing["seconds"] = time.monotonic() - started
+
+class ProviderRateLimiter:
+    """Keeps one provider's traffic under its RPM and TPM quotas with adaptive concurrency.
+
+    Retryable failures are retried with jittered exponential backoff, and a Retry-After from
+    a 429 pauses every caller of the provider, not just the one that saw it.
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrencyLimit(initial_concurrency(rpm))
+        self.paused_until = 0.0
+        self.stats = {"calls": 0, "succeeded": 0, "failed": 0, "rate_limited": 0, "retries": 0}
+
+    async def _wait_for_pause(self):
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def run(self, func: Callable[[], Awaitable[Any]], estimated_tokens: int, timeout: Optional[float] = None,
+                  timing: Optional[Dict[str, float]] = None) -> Any:
+        """Call func() within the provider's limits, retrying rate limits and transient errors
+
+        timeout bounds each request to the provider, not the time spent queued or backing off
+        here; a request that overruns it raises AttemptTimeout and is not retried. timing, if
+        given, receives the duration of the last request.
+        """
+        self.stats["calls"] += 1
+        timing = timing if timing is not None else {}
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self._wait_for_pause()
+            await self.concurrency.acquire()
+            try:
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimated_tokens)
+                result = await timed_request(func, timeout, timing)
+                self.concurrency.on_success(timing["seconds"])
+                self.stats["succeeded"] += 1
+                return result
+            except Exception as e:
+                retryable, rate_limited, retry_after = provider_error_info(e)
+                if rate_limited:
+                    self.stats["rate_limited"] += 1
+                    self.concurrency.on_rate_limited()
+                    self.requests.drain()
+                if not retryable or attempt == LLM_MAX_RETRIES:
+                    self.stats["failed"] += 1
+                    raise
+                # Full jitter keeps retries from many callers from arriving in lockstep
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                if rate_limited:
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.stats["retries"] += 1
+                logger.warning(f"{self.name} call failed ({e}); retry {attempt + 1} in {delay:.1f}s")
+            finally:
+                await self.concurrency.release()
+            # Back off without holding a concurrency slot
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "requests_available": int(self.requests.tokens),
+            "tokens_available": int(self.tokens.tokens),
+            "paused_for_seconds": round(max(0.0, self.paused_until - time.monotonic()), 1)
+        }
+
+# Hedging: a call still unanswered at this percentile of the route's recent latency gets a
+# duplicate on the same route ("same") or the role's next route ("alternate"); first answer wins
+HEDGING_ENABLED = os.environ.get('HEDGING_ENABLED', 'false').lower() == 'true'
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '0.95'))
+HEDGE_MIN_DELAY_SECONDS = float(os.environ.get('HEDGE_MIN_DELAY_SECONDS', '2'))
+HEDGE_TARGET = os.environ.get('HEDGE_TARGET', 'alternate')
+
+# Provider prompt caching: CV prompts share a byte-identical prefix (system prompt, then the CV)
+# that Anthropic caches via cache_control and OpenAI caches automatically
+LLM_PROMPT_CACHING_ENABLED = os.environ.get('LLM_PROMPT_CACHING_ENABLED', 'true').lower() == 'true'
+ANTHROPIC_PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+# Providers whose cache entry only exists once the request that wrote it has been answered;
+# concurrent calls sharing a prefix there would each pay for the write, so they are staggered
+PROMPT_CACHE_WRITE_PROVIDERS = ("anthropic", "fake")
+
+class PrefixCacheStats:
+    """Per-provider counts of prompt tokens served from the provider's prefix cache"""
+
+    def __init__(self):
+        self.providers = {}
+
+    def record(self, provider: str, input_tokens: int, cached_tokens: int = 0, cache_write_tokens: int = 0):
+        stats = self.providers.setdefault(provider, {
+            "requests": 0, "hits": 0, "input_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0
+        })
+        stats["requests"] += 1
+        stats["hits"] += 1 if cached_tokens else 0
+        stats["input_tokens"] += input_tokens or 0
+        stats["cached_tokens"] += cached_tokens or 0
+        stats["cache_write_tokens"] += cache_write_tokens or 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            provider: {
+                **stats,
+                "hit_rate": round(stats["hits"] / stats["requests"], 3) if stats["requests"] else 0.0,
+                "cached_token_ratio": round(stats["cached_tokens"] / stats["input_tokens"], 3) if stats["input_tokens"] else 0.0
+            }
+            for provider, stats in self.providers.items()
+        }
+
+# Local fake provider for exercising routing, e.g. LLM_ROUTE_STRATEGIC=fake:slow,fake:fast
+FAKE_PROVIDER_ENABLED = os.environ.get('FAKE_PROVIDER_ENABLED', 'false').lower() == 'true'
+FAKE_PROVIDER_RESPONSE = os.environ.get(
+    'FAKE_PROVIDER_RESPONSE', '{"overall_score": 75, "analytical_score": 72, "summary": "Fake provider response"}'
+)
+
+class FakeProviderError(Exception):
+    status_code = 503
+
+class FakeProvider:
+    """In-process provider whose latency and failure rate can be set per model"""
+
+    def __init__(self, response: str = FAKE_PROVIDER_RESPONSE):
+        self.response = response
+        self.faults = {}
+        self.calls = {}
+        self.cached_prefixes = set()
+
+    def configure(self, model: str, latency_seconds: float = 0.0, failure_rate: float = 0.0):
+        self.faults[model] = {"latency_seconds": latency_seconds, "failure_rate": failure_rate}
+
+    async def complete(self, model: str, system: str, prompt: str, temperature: float, max_tokens: int,
+                       prefix: str = None) -> Tuple[str, Dict[str, int]]:
+        """Return (text, usage); like a provider prefix cache, a system + prefix is a hit only if it
+        is byte-identical to one written by a call that had finished before this one started"""
+        self.calls[model] = self.calls.get(model, 0) + 1
+        fault = self.faults.get(model, {})
+        prefix_hash = hashlib.sha256((system + prefix).encode('utf-8')).hexdigest() if prefix else None
+        cached = prefix_hash in self.cached_prefixes
+        await asyncio.sleep(fault.get("latency_seconds", 0.0))
+        if random.random() < fault.get("failure_rate", 0.0):
+            raise FakeProviderError(f"Injected failure for fake model {model}")
+        usage = {"input_tokens": estimate_tokens(system + (prefix or "") + prompt), "cached_tokens": 0, "cache_write_tokens": 0}
+        if prefix:
+            usage["cached_tokens" if cached else "cache_write_tokens"] = estimate_tokens(system + prefix)
+            self.cached_prefixes.add(prefix_hash)
+        return self.response, usage
+
+class ProviderClients:
+    """Async OpenAI and Anthropic clients sharing pooled keep-alive connections"""
+
+    def __init__(self):
+        self.anthropic_http = None
+        self.anthropic = None
+        self.openai_session = None
+        self.limiters = {
+            "openai": ProviderRateLimiter("OpenAI", OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT),
+            "anthropic": ProviderRateLimiter("Anthropic", ANTHROPIC_RPM_LIMIT, ANTHROPIC_TPM_LIMIT),
+        }
+        self.fake = FakeProvider() if FAKE_PROVIDER_ENABLED else None
+        self.prefix_cache = PrefixCacheStats()
+
+    @staticmethod
+    def estimate_request_tokens(messages: List[Dict[str, str]], system: str = None, max_tokens: int = 0) -> int:
+        """Tokens a request counts against TPM: the prompt plus the completion it may produce"""
+        prompt = system or ""
+        for message in messages:
+            content = message.get("content", "")
+            # Anthropic content may be a list of text blocks
+            prompt += content if isinstance(content, str) else "".join(block.get("text", "") for block in content)
+        return estimate_tokens(prompt) + (max_tokens or 0)
+
+    async def start(self):
+        """Open the connection pools (idempotent)"""
+        if self.anthropic is None:
+            self.anthropic_http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+            )
+            self.anthropic = anthropic.AsyncAnthropic(
+                api_key=os.environ.get('ANTHROPIC_API_KEY'),
+                http_client=self.anthropic_http,
+                max_retries=0  # retries are handled by the rate limiter
+            )
+        if self.openai_session is None or self.openai_session.closed:
+            self.openai_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=LLM_MAX_CONNECTIONS,
+                    keepalive_timeout=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=aiohttp.ClientTimeout(total=LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+            )
+
+    async def close(self):
+        """Close the connection pools"""
+        if self.anthropic_http is not None:
+            await self.anthropic_http.aclose()
+            self.anthropic_http = None
+            self.anthropic = None
+        if self.openai_session is not None:
+            await self.openai_session.close()
+            self.openai_session = None
+
+    async def openai_chat(self, timeout: Optional[float] = None, timing: Optional[Dict[str, float]] = None,
+                          **kwargs) -> str:
+        """Create an OpenAI chat completion over the shared session and return its text"""
+        await self.start()
+
+        async def call():
+            # openai 0.28 picks the aiohttp session up from a context variable
+            openai.aiosession.set(self.openai_session)
+            return await openai.ChatCompletion.acreate(request_timeout=LLM_REQUEST_TIMEOUT, **kwargs)
+
+        estimated = self.estimate_request_tokens(kwargs.get("messages", []), max_tokens=kwargs.get("max_tokens"))
+        response = await self.limiters["openai"].run(call, estimated, timeout, timing)
+        usage = response.get("usage") or {}
+        self.prefix_cache.record(
+            "openai",
+            usage.get("prompt_tokens", 0),
+            (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        )
+        return response.choices[0].message.content
+
+    async def claude_message(self, timeout: Optional[float] = None, timing: Optional[Dict[str, float]] = None,
+                             **kwargs) -> str:
+        """Create an Anthropic message over the shared HTTP pool and return its text"""
+        await self.start()
+        estimated = self.estimate_request_tokens(
+            kwargs.get("messages", []), kwargs.get("system"), kwargs.get("max_tokens")
+        )
+        message = await self.limiters["anthropic"].run(
+            lambda: self.anthropic.messages.create(**kwargs), estimated, timeout, timing
+        )
+        usage = message.usage
+        cached = getattr(usage, "cache_read_input_tokens", 0) or 0
+        written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        self.prefix_cache.record("anthropic", usage.input_tokens + cached + written, cached, written)
+        return message.content[0].text
+
+    async def complete(self, provider: str, model: str, system: str, prompt: str, temperature: float,
+                       max_tokens: int, prefix: str = None, timeout: Optional[float] = None,
+                       timing: Optional[Dict[str, float]] = None) -> str:
+        """Single-turn completion with a system prompt on any configured provider
+
+        prefix, if given, opens the user message ahead of prompt. Callers keep it (and system)
+        byte-identical across calls over the same CV so providers can serve it from their cache.
+        timeout and timing apply to the provider request itself, as in ProviderRateLimiter.run.
+        """
+        if provider == "openai":
+            # OpenAI caches the longest previously seen prompt prefix automatically
+            return await self.openai_chat(
+                model=model,
+                messages=[{"role": "system", "content": system}, {"role": "user", "content": (prefix or "") + prompt}],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout,
+                timing=timing
+            )
+        if provider == "anthropic":
+            extra = {}
+            content = prompt
+            if prefix:
+                prefix_block = {"type": "text", "text": prefix}
+                if LLM_PROMPT_CACHING_ENABLED:
+                    prefix_block["cache_control"] = {"type": "ephemeral"}
+                    extra["extra_headers"] = {"anthropic-beta": ANTHROPIC_PROMPT_CACHING_BETA}
+                content = [prefix_block, {"type": "text", "text": prompt}]
+            return await self.claude_message(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system,
+                messages=[{"role": "user", "content": content}],
+                timeout=timeout,
+                timing=timing,
+                **extra
+            )
+        if provider == "fake" and self.fake is not None:
+            content, usage = await timed_request(
+                lambda: self.fake.complete(model, system, prompt, temperature, max_tokens, prefix), timeout, timing
+            )
+            self.prefix_cache.record("fake", usage["input_tokens"], usage["cached_tokens"], usage["cache_write_tokens"])
+            return content
+        raise ValueError(f"Unknown or disabled provider: {provider}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: limiter.get_stats() for name, limiter in self.limiters.items()}
+
+provider_clients = ProviderClients()
+
+# Model routing: each role has an ordered list of "provider:model" routes, primary first
+MODEL_ROUTES = {
+    role: [route.strip() for route in os.environ.get(f'LLM_ROUTE_{role.upper()}', default).split(',') if route.strip()]
+    for role, default in {
+        "creative": "openai:gpt-4-turbo-preview,anthropic:claude-3-opus-20240229",
+        "strategic": "anthropic:claude-3-opus-20240229,openai:gpt-4-turbo-preview",
+        "skills": "anthropic:claude-3-opus-20240229,openai:gpt-4-turbo-preview",
+        "ensemble": "openai:gpt-4-turbo-preview,anthropic:claude-3-opus-20240229",
+        "company": "openai:gpt-4-turbo-preview,anthropic:claude-3-opus-20240229",
+        "fast": "openai:gpt-3.5-turbo,anthropic:claude-3-haiku-20240307",
+    }.items()
+}
+ROUTER_WINDOW_SIZE = int(os.environ.get('ROUTER_WINDOW_SIZE', '50'))
+ROUTER_MIN_CALLS = int(os.environ.get('ROUTER_MIN_CALLS', '5'))
+ROUTER_ERROR_RATE_THRESHOLD = float(os.environ.get('ROUTER_ERROR_RATE_THRESHOLD', '0.5'))
+ROUTER_P95_THRESHOLD_SECONDS = float(os.environ.get('ROUTER_P95_THRESHOLD_SECONDS', '60'))
+ROUTER_CIRCUIT_OPEN_SECONDS = float(os.environ.get('ROUTER_CIRCUIT_OPEN_SECONDS', '30'))
+# A request to a route with a fallback that has not answered within this long is abandoned
+# for the next route. Keep it above the p95 threshold: no latency above it is ever recorded.
+ROUTER_ATTEMPT_TIMEOUT_SECONDS = float(os.environ.get('ROUTER_ATTEMPT_TIMEOUT_SECONDS', '90'))
+if ROUTER_P95_THRESHOLD_SECONDS >= ROUTER_ATTEMPT_TIMEOUT_SECONDS:
+    logger.warning("ROUTER_P95_THRESHOLD_SECONDS is not below ROUTER_ATTEMPT_TIMEOUT_SECONDS; "
+                   "the latency circuit breaker can never open for routes with a fallback")
+
+class RouteHealth:
+    """Rolling latency and error window for one provider:model, with a circuit breaker.
+
+    The circuit opens when the window's error rate or p95 latency passes its threshold, stays
+    open for ROUTER_CIRCUIT_OPEN_SECONDS, then lets a single probe through (half-open).
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.window = deque(maxlen=ROUTER_WINDOW_SIZE)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.window if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    @property
+    def error_rate(self) -> float:
+        return sum(1 for _, ok in self.window if not ok) / len(self.window) if self.window else 0.0
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= ROUTER_CIRCUIT_OPEN_SECONDS:
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+        return self.state == "closed"
+
+    def release_probe(self):
+        """Give back a half-open probe whose call ended without an answer either way (cancelled)"""
+        self.probe_in_flight = False
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        self.failures += 0 if ok else 1
+        if self.state == "half_open":
+            self.probe_in_flight = False
+            if ok:
+                # A successful probe closes the circuit with a fresh window
+                self.state = "closed"
+                self.window.clear()
+            else:
+                self._open()
+        self.window.append((latency, ok))
+        if self.state == "closed" and len(self.window) >= ROUTER_MIN_CALLS:
+            p95 = self.percentile(0.95)
+            if self.error_rate >= ROUTER_ERROR_RATE_THRESHOLD or (p95 is not None and p95 > ROUTER_P95_THRESHOLD_SECONDS):
+                self._open()
+
+    def _open(self):
+        logger.warning(f"Circuit opened for {self.route}")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "error_rate": round(self.error_rate, 3),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+class ProviderRouter:
+    """Sends each role's completion to its first healthy route, falling back down the list"""
+
+    def __init__(self, clients: ProviderClients, routes: Dict[str, List[str]] = MODEL_ROUTES):
+        self.clients = clients
+        self.routes = routes
+        self.health = {}
+        self.fallbacks = 0
+        self.hedge_stats = {}
+
+    def _health(self, route: str) -> RouteHealth:
+        if route not in self.health:
+            self.health[route] = RouteHealth(route)
+        return self.health[route]
+
+    def primary(self, role: str) -> str:
+        return self.routes[role][0]
+
+    def _hedge_route(self, role: str, route: str) -> str:
+        if HEDGE_TARGET == "alternate":
+            for candidate in self.routes[role]:
+                if candidate != route and self._health(candidate).state == "closed":
+                    return candidate
+        return route
+
+    async def _attempt(self, route: str, system: str, prompt: str, temperature: float, max_tokens: int,
+                       prefix: str = None, timeout: Optional[float] = None) -> str:
+        """One call to route, recorded against its health with the provider request's own latency
+
+        Time spent queued in the provider's rate limiter is neither recorded nor counted
+        against timeout; that is local load, not the route's health.
+        """
+        provider, model = route.split(":", 1)
+        health = self._health(route)
+        timing = {}
+        try:
+            content = await self.clients.complete(
+                provider, model, system, prompt, temperature, max_tokens, prefix, timeout=timeout, timing=timing
+            )
+        except asyncio.CancelledError:
+            # No verdict either way; a hedged loser has already been recorded by _hedged_call
+            health.release_probe()
+            raise
+        except Exception:
+            health.record(timing.get("seconds", 0.0), ok=False)
+            raise
+        health.record(timing["seconds"], ok=True)
+        return content
+
+    async def _hedged_call(self, role: str, route: str, system: str, prompt: str, temperature: float,
+                           max_tokens: int, prefix: str = None, timeout: Optional[float] = None) -> Tuple[str, str]:
+        """Call route, duplicating the request if it outlives the hedge delay; returns (text, winning route)"""
+        def start(target: str) -> asyncio.Task:
+            task = asyncio.create_task(self._attempt(target, system, prompt, temperature, max_tokens, prefix, timeout))
+            tasks[task] = (target, time.monotonic())
+            return task
+
+        percentile = self._health(route).percentile(HEDGE_PERCENTILE)
+        if percentile is None or len(self._health(route).window) < ROUTER_MIN_CALLS:
+            percentile = None  # not enough history to know what "slow" is yet
+        tasks = {}
+        primary = start(route)
+        try:
+            if percentile is not None:
+                done, _ = await asyncio.wait(tasks, timeout=max(percentile, HEDGE_MIN_DELAY_SECONDS))
+                if not done:
+                    hedge_route = self._hedge_route(role, route)
+                    stats = self.hedge_stats.setdefault(role, {"hedged": 0, "hedge_wins": 0})
+                    stats["hedged"] += 1
+                    logger.info(f"Hedging slow {role} call to {route} with {hedge_route}")
+                    start(hedge_route)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_stats[role]["hedge_wins"] += 1
+                        self._record_losers(tasks, task, pending)
+                        return task.result(), tasks[task][0]
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The losing (or abandoned) request is cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _record_losers(self, tasks: Dict[asyncio.Task, Tuple[str, float]], winner: asyncio.Task, pending):
+        """Count a still-running loser that started before the winner as a failed call.
+
+        Its real latency is never seen, so it cannot go into the latency window; without this a
+        degraded primary that always loses to its hedge would never trip its circuit breaker.
+        """
+        now = time.monotonic()
+        for task in pending:
+            route, started = tasks[task]
+            if started < tasks[winner][1]:
+                self._health(route).record(now - started, ok=False)
+
+    async def complete(self, role: str, system: str, prompt: str, temperature: float,
+                       max_tokens: int, hedge: bool = False, prefix: str = None) -> Tuple[str, str]:
+        """Return (text, route) from the first route whose circuit admits the call and that answers.
+
+        When every circuit is open the primary is tried anyway rather than failing outright.
+        Each attempt records its own outcome against the route that made it.
+        """
+        routes = self.routes[role]
+        last_error = None
+        attempted = False
+        for index, route in enumerate(routes):
+            is_last = index == len(routes) - 1
+            # Checked lazily so a half-open circuit only reserves its probe when actually tried
+            if not self._health(route).allow():
+                if attempted or not is_last:
+                    continue
+                route = routes[0]
+            attempted = True
+            # A route that has not answered within the attempt timeout is abandoned for the next one
+            timeout = ROUTER_ATTEMPT_TIMEOUT_SECONDS if not is_last else None
+            try:
+                if hedge:
+                    return await self._hedged_call(role, route, system, prompt, temperature, max_tokens, prefix, timeout)
+                return await self._attempt(route, system, prompt, temperature, max_tokens, prefix, timeout), route
+            except asyncio.CancelledError:
+                # A deadline, a client disconnect or a quorum cancel says nothing about the route
+                self._health(route).release_probe()
+                raise
+            except Exception as e:
+                last_error = e
+                if not is_last:
+                    self.fallbacks += 1
+                    logger.warning(f"{role} call to {route} failed ({e or type(e).__name__}); falling back")
+        raise last_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        for routes in self.routes.values():
+            for route in routes:
+                self._health(route)
+        return {
+            "routes": self.routes,
+            "fallbacks": self.fallbacks,
+            "hedging": {"enabled": HEDGING_ENABLED, "percentile": HEDGE_PERCENTILE, "by_role": self.hedge_stats},
+            "models": {route: health.get_stats() for route, health in self.health.items()},
+        }
+
+provider_router = ProviderRouter(provider_clients)
+
+# LLM response cache settings
+# Bump PROMPT_TEMPLATE_VERSION whenever prompt wording changes so stale answers are not served
+PROMPT_TEMPLATE_VERSION = "2025-03"
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '512'))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', '86400'))
+LLM_CACHE_MONGO_ENABLED = os.environ.get('LLM_CACHE_MONGO_ENABLED', 'true').lower() == 'true'
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class TieredCache:
+    """In-process LRU tier with TTL in front of an optional MongoDB tier with a TTL index"""
+
+    def __init__(self, name: str, collection, max_entries: int, ttl_seconds: int, mongo_enabled: bool):
+        self.name = name
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.mongo_enabled = mongo_enabled
+        self.memory = TTLCache(max_entries, ttl_seconds)
+        self.stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "bypassed": 0, "writes": 0, "errors": 0}
+
+    async def ensure_indexes(self):
+        """Create the unique key index and the TTL index that lets MongoDB expire entries"""
+        await self.collection.create_index("key", unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def should_store(self, value: Dict[str, Any]) -> bool:
+        return True
+
+    async def get(self, key: str, bypass: bool = False) -> Optional[Dict[str, Any]]:
+        if bypass:
+            self.stats["bypassed"] += 1
+            return None
+
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return copy.deepcopy(value)
+
+        if self.mongo_enabled:
+            try:
+                doc = await self.collection.find_one(
+                    {"key": key, "expires_at": {"$gt": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"{self.name} cache read error: {e}")
+                self.stats["errors"] += 1
+                doc = None
+            if doc:
+                self.stats["mongo_hits"] += 1
+                self.memory.set(key, doc["value"])
+                return copy.deepcopy(doc["value"])
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        if not self.should_store(value):
+            return
+        value = copy.deepcopy(value)
+        self.memory.set(key, value)
+        self.stats["writes"] += 1
+
+        if self.mongo_enabled:
+            now = datetime.utcnow()
+            try:
+                await self.collection.update_one(
+                    {"key": key},
+                    {"$set": {
+                        "value": value,
+                        "created_at": now,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.warning(f"{self.name} cache write error: {e}")
+                self.stats["errors"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["mongo_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "mongo_enabled": self.mongo_enabled
+        }
+
+class LLMResponseCache(TieredCache):
+    """Content-addressed LLM response cache"""
+
+    def __init__(self, collection, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = LLM_CACHE_TTL_SECONDS, mongo_enabled: bool = LLM_CACHE_MONGO_ENABLED):
+        super().__init__("LLM response", collection, max_entries, ttl_seconds, mongo_enabled)
+
+    @staticmethod
+    def make_key(stage: str, model: str, temperature: float, content: str, target_role: str = None) -> str:
+        """Hash everything that determines a response into a stable cache key"""
+        payload = json.dumps(
+            [PROMPT_TEMPLATE_VERSION, stage, model, temperature, content, target_role],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def should_store(self, value: Dict[str, Any]) -> bool:
+        # Never cache failed provider calls
+        return "error" not in value
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), "prompt_template_version": PROMPT_TEMPLATE_VERSION}
+
+llm_cache = LLMResponseCache(llm_cache_collection)
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key onto one in-flight computation"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight = {}
+        self.stats = {"started": 0, "coalesced": 0}
+
+    async def do(self, key: str, func, *args, **kwargs):
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(func(*args, **kwargs))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self.stats["started"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        # Shield the shared task so one caller disconnecting doesn't cancel it for the others
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"{self.name} single-flight call failed: {task.exception()}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": len(self.in_flight)}
+
+# Company intelligence freshness: serve stored intelligence for TTL hours, then serve it
+# stale for another GRACE hours while it is refreshed in the background
+COMPANY_INTEL_TTL_HOURS = float(os.environ.get('COMPANY_INTEL_TTL_HOURS', '24'))
+COMPANY_INTEL_GRACE_HOURS = float(os.environ.get('COMPANY_INTEL_GRACE_HOURS', '24'))
 
 class CVAnalysisRequest(BaseModel):
     cv_text: str
     target_role: Optional[str] = None
     target_company: Optional[str] = None
+    bypass_cache: bool = False
+    ensemble_mode: Optional[Literal["llm", "local"]] = None
+    deadline_seconds: Optional[float] = Field(None, gt=0)
+    ensemble_quorum: Optional[int] = Field(None, ge=1, le=3)
+    analysis_tier: Optional[Literal["auto", "fast", "standard", "deep"]] = None
+
+class AnalysisJobRequest(CVAnalysisRequest):
+    priority: int = 0
+
+class FakeProviderFaults(BaseModel):
+    model: str
+    latency_seconds: float = 0.0
+    failure_rate: float = 0.0
 
 class CompanyResearchRequest(BaseModel):
     company_name: str
     role_type: Optional[str] = None
+    force_refresh: bool = False
 
 class AnalysisResponse(BaseModel):
     analysis_id: str
     cv_improvements: Dict[str, Any]
     skills_analysis: Dict[str, Any]
     company_insights: Optional[Dict[str, Any]] = None
-    confidence_score: float
+    confidence_score: Optional[float] = None
     recommendations: List[str]
+    cv_preprocessing: Optional[Dict[str, Any]] = None
+    ai_results: Optional[Dict[str, Any]] = None
+    stage_status: Dict[str, str] = {}
+    partial: bool = False
+
+# Request deadlines: every stage of one analysis shares a single time budget
+ANALYSIS_DEADLINE_SECONDS = float(os.environ.get('ANALYSIS_DEADLINE_SECONDS', '120'))
+ANALYSIS_MAX_DEADLINE_SECONDS = float(os.environ.get('ANALYSIS_MAX_DEADLINE_SECONDS', '600'))
+# Absolute time.monotonic() deadline of the analysis being run in this context, if any
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('request_deadline', default=None)
+
+def time_remaining() -> Optional[float]:
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def stage_status(result: Any) -> str:
+    """completed, failed, timed_out or pending, from a stage's result"""
+    if isinstance(result, dict) and result.get("pending"):
+        return "pending"
+    if isinstance(result, dict) and "error" in result:
+        return "timed_out" if result.get("timed_out") else "failed"
+    return "completed"
+
+# Awaited with (stage, result, duration_seconds) whenever a pipeline stage finishes
+StageCallback = Callable[[str, Any, float], Awaitable[None]]
+
+async def run_stage(stage: str, coro: Awaitable, on_stage: Optional[StageCallback] = None,
+                    reserve: float = 0.0, bounded: bool = True):
+    """Await one pipeline stage and report its result and duration to on_stage
+
+    A stage still running at the request deadline, less reserve seconds held back for later
+    stages, is cancelled and yields a timed-out result. In-process stages that cannot block
+    pass bounded=False and always run to completion.
+    """
+    started = time.monotonic()
+    remaining = time_remaining() if bounded else None
+    try:
+        result = await (coro if remaining is None else asyncio.wait_for(coro, max(remaining - reserve, 0)))
+    except asyncio.TimeoutError:
+        logger.warning(f"Stage {stage} cancelled at the request deadline")
+        result = {"error": "Deadline exceeded before this stage finished", "timed_out": True}
+    if on_stage is not None:
+        await on_stage(stage, result, time.monotonic() - started)
+    return result
+
+# Early-quorum ensemble: synthesis starts once this many of the three upstream analyses have
+# succeeded, or once the quorum timeout passes with at least one in (0 disables the timeout)
+ENSEMBLE_QUORUM = int(os.environ.get('ENSEMBLE_QUORUM', '3'))
+ENSEMBLE_QUORUM_TIMEOUT_SECONDS = float(os.environ.get('ENSEMBLE_QUORUM_TIMEOUT_SECONDS', '0'))
+# Share of a deadline's remaining time held back from the upstream analyses for the LLM ensemble
+# (capped at ENSEMBLE_RESERVE_SECONDS); with less than ENSEMBLE_MIN_SECONDS left when synthesis
+# starts, the local ensemble is used instead of the LLM one
+ENSEMBLE_RESERVE_FRACTION = float(os.environ.get('ENSEMBLE_RESERVE_FRACTION', '0.25'))
+ENSEMBLE_RESERVE_SECONDS = float(os.environ.get('ENSEMBLE_RESERVE_SECONDS', '30'))
+ENSEMBLE_MIN_SECONDS = float(os.environ.get('ENSEMBLE_MIN_SECONDS', '5'))
+
+# Analysis tiers: "fast" is one combined prompt on a low-latency model plus the local ensemble,
+# "standard" the configured multi-AI pipeline, "deep" that pipeline with the LLM ensemble over all
+# three analyses. "auto" picks fast for short CVs or when many analyses are already running.
+ANALYSIS_TIER = os.environ.get('ANALYSIS_TIER', 'standard')
+FAST_TIER_MAX_CV_TOKENS = int(os.environ.get('FAST_TIER_MAX_CV_TOKENS', '1500'))
+FAST_TIER_LOAD_THRESHOLD = int(os.environ.get('FAST_TIER_LOAD_THRESHOLD', '8'))
+
+# Awaited with (stage, result) when an upstream analysis finishes after the ensemble has started
+LateResultCallback = Callable[[str, Any], Awaitable[None]]
+
+# Local ensemble: "llm" merges the upstream analyses with a fourth model call, "local" in-process
+ENSEMBLE_MODE = os.environ.get('ENSEMBLE_MODE', 'llm')
+ENSEMBLE_SIMILARITY_THRESHOLD = float(os.environ.get('ENSEMBLE_SIMILARITY_THRESHOLD', '0.35'))
+ENSEMBLE_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the their this to "
+    "with your you more most should could would will can add better".split()
+)
+
+class LocalEnsembleEngine:
+    """Deterministic in-process replacement for the LLM ensemble, with the same output schema"""
+
+    # (source, fields) whose items are candidate recommendations, in priority order
+    RECOMMENDATION_FIELDS = [
+        ("gpt4_creative", ["critical_improvements", "missing_elements"]),
+        ("claude_strategic", ["strategic_weaknesses", "credibility_assessment"]),
+        ("claude_skills", ["competitive_gaps", "learning_roadmap"]),
+    ]
+    SOURCE_NAMES = {
+        "gpt4_creative": "GPT-4 Creative Engine",
+        "claude_strategic": "Claude Strategic Analyst",
+        "claude_skills": "Claude Skills Intelligence",
+    }
+
+    def __init__(self, similarity_threshold: float = ENSEMBLE_SIMILARITY_THRESHOLD):
+        self.similarity_threshold = similarity_threshold
+
+    @staticmethod
+    def extract_score(value: Any) -> Optional[float]:
+        """Read a 1-100 score from a number, a {"score": ...} object or text like "78 - strong" """
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return float(value) if 0 <= value <= 100 else None
+        if isinstance(value, dict):
+            for key in ("score", "value", "rating", "overall"):
+                if key in value:
+                    return LocalEnsembleEngine.extract_score(value[key])
+            return None
+        if isinstance(value, str):
+            match = re.search(r'\d+(?:\.\d+)?', value)
+            return LocalEnsembleEngine.extract_score(float(match.group())) if match else None
+        return None
+
+    @staticmethod
+    def to_items(value: Any) -> List[str]:
+        """Flatten a field (list, object or text) into individual recommendation strings"""
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [line.strip(" -*•\t") for line in value.split('\n') if line.strip(" -*•\t")]
+        if isinstance(value, list):
+            items = []
+            for entry in value:
+                if isinstance(entry, dict) and all(isinstance(v, (str, int, float)) for v in entry.values()):
+                    # A recommendation object such as {"area": ..., "suggestion": ...} is one item
+                    items.append(" - ".join(str(v) for v in entry.values()))
+                else:
+                    items.extend(LocalEnsembleEngine.to_items(entry))
+            return [item for item in items if item]
+        if isinstance(value, dict):
+            return [item for v in value.values() for item in LocalEnsembleEngine.to_items(v)]
+        return [str(value)]
+
+    @staticmethod
+    def terms(text: str) -> frozenset:
+        return frozenset(w for w in re.findall(r'[a-z0-9+#]+', text.lower()) if w not in ENSEMBLE_STOPWORDS and len(w) > 1)
+
+    def cluster(self, items: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Greedily group (source, text) items whose term sets overlap above the threshold"""
+        clusters = []
+        for position, (source, text) in enumerate(items):
+            terms = self.terms(text)
+            if not terms:
+                continue
+            best, best_similarity = None, 0.0
+            for cluster in clusters:
+                similarity = len(terms & cluster["terms"]) / len(terms | cluster["terms"])
+                if similarity > best_similarity:
+                    best, best_similarity = cluster, similarity
+            if best is not None and best_similarity >= self.similarity_threshold:
+                best["texts"].append(text)
+                best["sources"].add(source)
+                best["terms"] = best["terms"] | terms
+            else:
+                clusters.append({"texts": [text], "sources": {source}, "terms": terms, "position": position})
+        return clusters
+
+    def combine(self, analyses: Dict[str, Dict[str, Any]], target_role: str = None) -> Dict[str, Any]:
+        """Merge the upstream analyses into consensus scores, agreement areas and ranked priorities"""
+        usable = {name: analysis for name, analysis in analyses.items() if "error" not in analysis}
+        if not usable:
+            return {"error": "No upstream analyses available", "ai_source": "Local Ensemble Engine"}
+
+        scores = {}
+        for name, field in (("gpt4_creative", "overall_score"), ("claude_strategic", "analytical_score")):
+            score = self.extract_score(usable.get(name, {}).get(field))
+            if score is not None:
+                scores[name] = score
+        consensus_score = round(sum(scores.values()) / len(scores), 1) if scores else None
+        score_spread = max(scores.values()) - min(scores.values()) if len(scores) > 1 else 0.0
+
+        items = [
+            (source, text)
+            for source, fields in self.RECOMMENDATION_FIELDS
+            for field in fields
+            for text in self.to_items(usable.get(source, {}).get(field))
+        ]
+        clusters = self.cluster(items)
+        # Rank by how many analyses raised a point, then how often, then how early
+        clusters.sort(key=lambda c: (-len(c["sources"]), -len(c["texts"]), c["position"]))
+        shared = [c for c in clusters if len(c["sources"]) > 1]
+        unified_priorities = [c["texts"][0] for c in clusters[:5]]
+
+        disagreement = []
+        if score_spread > 15:
+            disagreement.append(
+                "Scores differ by " + f"{score_spread:g} points ("
+                + ", ".join(f"{self.SOURCE_NAMES[n]}: {s:g}" for n, s in scores.items())
+                + "); treat the overall rating as uncertain"
+            )
+        for cluster in [c for c in clusters if len(c["sources"]) == 1][:3]:
+            source = next(iter(cluster["sources"]))
+            disagreement.append(f"Only {self.SOURCE_NAMES[source]} raised: {cluster['texts'][0]}")
+
+        # Confidence falls with score spread, rises with cross-model agreement and coverage
+        agreement_ratio = len(shared) / len(clusters) if clusters else 0.0
+        coverage = len(usable) / len(analyses)
+        ai_confidence = round(max(0.0, min(100.0, (100 - score_spread) * (0.6 + 0.4 * agreement_ratio) * coverage)), 1)
+
+        strengths = self.to_items(usable.get("gpt4_creative", {}).get("strengths"))
+        differentiation = self.to_items(usable.get("claude_strategic", {}).get("differentiation_strategy"))
+        risks = [
+            text
+            for source, field in (("claude_strategic", "strategic_weaknesses"), ("claude_skills", "competitive_gaps"))
+            for text in self.to_items(usable.get(source, {}).get(field))
+        ]
+        positioning = self.to_items(usable.get("claude_strategic", {}).get("professional_positioning")) \
+            + self.to_items(usable.get("claude_strategic", {}).get("market_alignment"))
+
+        return {
+            "consensus_score": consensus_score,
+            "ai_agreement_areas": [c["texts"][0] for c in shared[:5]],
+            "ai_disagreement_areas": disagreement,
+            "unified_priorities": unified_priorities,
+            "competitive_advantage": (strengths[:3] + differentiation[:2]),
+            "risk_assessment": risks[:5],
+            "success_probability": {
+                "estimate": consensus_score,
+                "reasoning": f"Average of {len(scores)} model scores for {target_role or 'the target role'}"
+                             f" with {len(shared)} shared recommendations",
+            },
+            "ai_confidence": ai_confidence,
+            "personalized_strategy": {
+                "days_1_30": unified_priorities[:2],
+                "days_31_60": unified_priorities[2:4],
+                "days_61_90": unified_priorities[4:],
+            },
+            "market_positioning": positioning[:3],
+            "ai_source": "Local Ensemble Engine",
+        }
+
+# Shared by every per-CV prompt so the system prompt and CV form one cacheable prefix;
+# role-specific personas and instructions follow the CV in the user message
+CV_ANALYSIS_SYSTEM_PROMPT = (
+    "You are JobPrep AI, a panel of career experts analyzing one candidate's CV. The CV and target "
+    "role come first; the expert role and analysis you are asked for follow them. Respond in JSON."
+)
+
+# Used by every prompt when the request names no target role
+DEFAULT_TARGET_ROLE = "General professional role"
+
+def build_cv_prompt_prefix(cv_text: str, target_role: str = None) -> str:
+    """The CV part of an analysis prompt, byte-identical for every analysis of the same CV and role"""
+    return f"""CV Content:
+{cv_text}
+
+Target Role: {target_role or DEFAULT_TARGET_ROLE}
+
+"""
 
 # Advanced Multi-AI Orchestration Engine
 class AIOrchestrator:
     def __init__(self):
-        self.claude_client = anthropic_client
-        
-    def analyze_cv_with_gpt4(self, cv_text: str, target_role: str = None) -> Dict[str, Any]:
-        """GPT-4 specialized for creative CV improvements and content generation"""
-        
-        prompt = f"""As an expert CV optimization specialist, analyze this CV and provide detailed improvements.
+        self.clients = provider_clients
+        self.router = provider_router
+        self.hedging = HEDGING_ENABLED
+        self.late_tasks = set()
+        self.active_analyses = 0
+        self.single_flight = SingleFlight("Multi-AI analysis")
+        self.local_ensemble = LocalEnsembleEngine()
 
-CV Content:
-{cv_text}
+    async def _finish(self, cache_key: str, role: str, route: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Tag a result with the model that produced it; only primary-model answers are cached"""
+        result["ai_model"] = route
+        if route == self.router.primary(role):
+            await llm_cache.set(cache_key, result)
+        return result
 
-Target Role: {target_role or "General professional role"}
+    async def analyze_cv_with_gpt4(self, cv_text: str, target_role: str = None, use_cache: bool = True) -> Dict[str, Any]:
+        """GPT-4 specialized for creative CV improvements and content generation"""
+        
+        prompt = f"""As an expert CV optimization specialist with 15+ years of HR experience, analyze this CV and provide detailed, creative and engaging improvements.
 
 Provide a comprehensive analysis in JSON format with these sections:
 
@@ -100,38 +1570,37 @@ Provide a comprehensive analysis in JSON format with these sections:
 
 Be specific, actionable, and focus on high-impact changes."""
 
+        cache_key = llm_cache.make_key("gpt4_creative", self.router.primary("creative"), 0.3, cv_text, target_role)
+        cached = await llm_cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            return cached
+
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are an expert CV optimization specialist with 15+ years of HR experience. Focus on creative and engaging improvements."},
-                    {"role": "user", "content": prompt}
-                ],
+            content, route = await self.router.complete(
+                "creative",
+                system=CV_ANALYSIS_SYSTEM_PROMPT,
+                prefix=build_cv_prompt_prefix(cv_text, target_role),
+                prompt=prompt,
                 temperature=0.3,
-                max_tokens=2000
+                max_tokens=2000,
+                hedge=self.hedging
             )
             
-            content = response.choices[0].message.content
             try:
                 result = json.loads(content)
                 result["ai_source"] = "GPT-4 Creative Engine"
-                return result
             except:
-                return {"analysis": content, "ai_source": "GPT-4 Creative Engine"}
+                result = {"analysis": content, "ai_source": "GPT-4 Creative Engine"}
+            return await self._finish(cache_key, "creative", route, result)
                 
         except Exception as e:
             logger.error(f"GPT-4 CV analysis error: {e}")
             return {"error": str(e), "ai_source": "GPT-4 Creative Engine"}
     
-    async def analyze_cv_with_claude(self, cv_text: str, target_role: str = None) -> Dict[str, Any]:
+    async def analyze_cv_with_claude(self, cv_text: str, target_role: str = None, use_cache: bool = True) -> Dict[str, Any]:
         """Claude specialized for deep analytical thinking and critical evaluation"""
         
-        prompt = f"""As a senior career strategist and CV critic, provide a thorough analytical assessment of this CV.
-
-CV Content:
-{cv_text}
-
-Target Role: {target_role or "General professional role"}
+        prompt = f"""As a senior career strategist and CV critic, provide a thorough analytical assessment of this CV focused on competitive positioning.
 
 Conduct a deep analysis and return JSON with:
 
@@ -146,35 +1615,38 @@ Conduct a deep analysis and return JSON with:
 
 Focus on strategic thinking, market positioning, and competitive advantage."""
 
+        cache_key = llm_cache.make_key("claude_strategic", self.router.primary("strategic"), 0.2, cv_text, target_role)
+        cached = await llm_cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            return cached
+
         try:
-            message = self.claude_client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=2000,
+            content, route = await self.router.complete(
+                "strategic",
+                system=CV_ANALYSIS_SYSTEM_PROMPT,
+                prefix=build_cv_prompt_prefix(cv_text, target_role),
+                prompt=prompt,
                 temperature=0.2,
-                system="You are a senior career strategist with deep analytical thinking capabilities. Provide thorough, strategic career advice focused on competitive positioning.",
-                messages=[{"role": "user", "content": prompt}]
+                max_tokens=2000,
+                hedge=self.hedging
             )
             
-            content = message.content[0].text
             try:
                 result = json.loads(content)
                 result["ai_source"] = "Claude Strategic Analyst"
-                return result
             except:
-                return {"analysis": content, "ai_source": "Claude Strategic Analyst"}
+                result = {"analysis": content, "ai_source": "Claude Strategic Analyst"}
+            return await self._finish(cache_key, "strategic", route, result)
                 
         except Exception as e:
             logger.error(f"Claude CV analysis error: {e}")
             return {"error": str(e), "ai_source": "Claude Strategic Analyst"}
     
-    async def analyze_skills_with_claude(self, cv_text: str, target_role: str = None) -> Dict[str, Any]:
+    async def analyze_skills_with_claude(self, cv_text: str, target_role: str = None, use_cache: bool = True) -> Dict[str, Any]:
         """Claude specialized for deep skills analysis and market intelligence"""
         
         prompt = f"""As a technical skills analyst and market intelligence expert, perform comprehensive skills analysis.
 
-CV Content: {cv_text}
-Target Role: {target_role or "Software Engineer"}
-
 Provide detailed JSON analysis:
 
 1. "current_skills_matrix": Detailed breakdown of skills by category with proficiency levels
@@ -188,40 +1660,56 @@ Provide detailed JSON analysis:
 
 Focus on strategic skill development and market positioning."""
 
+        cache_key = llm_cache.make_key("claude_skills", self.router.primary("skills"), 0.1, cv_text, target_role)
+        cached = await llm_cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            return cached
+
         try:
-            message = self.claude_client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=2000,
+            content, route = await self.router.complete(
+                "skills",
+                system=CV_ANALYSIS_SYSTEM_PROMPT,
+                prefix=build_cv_prompt_prefix(cv_text, target_role),
+                prompt=prompt,
                 temperature=0.1,
-                system="You are a technical skills analyst with deep market intelligence. Focus on strategic skill development and competitive advantage.",
-                messages=[{"role": "user", "content": prompt}]
+                max_tokens=2000,
+                hedge=self.hedging
             )
             
-            content = message.content[0].text
             try:
                 result = json.loads(content)
                 result["ai_source"] = "Claude Skills Intelligence"
-                return result
             except:
-                return {"analysis": content, "ai_source": "Claude Skills Intelligence"}
+                result = {"analysis": content, "ai_source": "Claude Skills Intelligence"}
+            return await self._finish(cache_key, "skills", route, result)
                 
         except Exception as e:
             logger.error(f"Claude skills analysis error: {e}")
             return {"error": str(e), "ai_source": "Claude Skills Intelligence"}
 
-    def create_ai_ensemble(self, gpt4_cv_analysis: Dict, claude_cv_analysis: Dict, claude_skills_analysis: Dict, target_role: str = None) -> Dict[str, Any]:
+    async def create_ai_ensemble(self, gpt4_cv_analysis: Dict, claude_cv_analysis: Dict, claude_skills_analysis: Dict, target_role: str = None, use_cache: bool = True) -> Dict[str, Any]:
         """Advanced AI ensemble that creates unified insights from multiple AI perspectives"""
         
+        sections, input_stats = build_ensemble_input({
+            "gpt4_creative": gpt4_cv_analysis,
+            "claude_strategic": claude_cv_analysis,
+            "claude_skills": claude_skills_analysis,
+        })
+        logger.info(
+            f"Ensemble input ({input_stats['mode']}): {input_stats['input_tokens']} tokens, "
+            f"{input_stats['tokens_saved']} saved"
+        )
+        
         ensemble_prompt = f"""As an AI ensemble coordinator, analyze these insights from multiple AI experts and create unified recommendations.
 
 GPT-4 Creative Analysis:
-{json.dumps(gpt4_cv_analysis, indent=2)}
+{sections["gpt4_creative"]}
 
 Claude Strategic Analysis:
-{json.dumps(claude_cv_analysis, indent=2)}
+{sections["claude_strategic"]}
 
 Claude Skills Intelligence:
-{json.dumps(claude_skills_analysis, indent=2)}
+{sections["claude_skills"]}
 
 Target Role: {target_role}
 
@@ -238,61 +1726,316 @@ Create a comprehensive JSON response with:
 9. "personalized_strategy": Tailored 90-day action plan
 10. "market_positioning": How to position against competitors
 
-This should be the definitive career guidance combining multiple AI perspectives."""
+This should be the definitive career guidance combining multiple AI perspectives."""
+
+        # The ensemble is keyed on the inputs it is actually shown rather than the raw CV
+        ensemble_inputs = json.dumps(sections, sort_keys=True)
+        cache_key = llm_cache.make_key("ai_ensemble", self.router.primary("ensemble"), 0.1, ensemble_inputs, target_role)
+        cached = await llm_cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            return {**cached, "ensemble_input": input_stats}
+
+        try:
+            content, route = await self.router.complete(
+                "ensemble",
+                system="You are an AI ensemble coordinator combining insights from multiple AI systems to provide superior career guidance.",
+                prompt=ensemble_prompt,
+                temperature=0.1,
+                max_tokens=2000,
+                hedge=self.hedging
+            )
+            
+            try:
+                result = json.loads(content)
+                result["ai_source"] = "Multi-AI Ensemble"
+            except:
+                result = {"analysis": content, "ai_source": "Multi-AI Ensemble"}
+            result = await self._finish(cache_key, "ensemble", route, result)
+            return {**result, "ensemble_input": input_stats}
+                
+        except Exception as e:
+            logger.error(f"AI Ensemble error: {e}")
+            return {"error": str(e), "ai_source": "Multi-AI Ensemble", "ensemble_input": input_stats}
+
+    async def create_local_ensemble(self, gpt4_cv_analysis: Dict, claude_cv_analysis: Dict, claude_skills_analysis: Dict, target_role: str = None) -> Dict[str, Any]:
+        """Ensemble insights computed in-process, without a fourth model call"""
+        return self.local_ensemble.combine({
+            "gpt4_creative": gpt4_cv_analysis,
+            "claude_strategic": claude_cv_analysis,
+            "claude_skills": claude_skills_analysis,
+        }, target_role)
+
+    async def full_multi_ai_analysis(self, cv_text: str, target_role: str = None, use_cache: bool = True,
+                                     on_stage: Optional[StageCallback] = None,
+                                     ensemble_mode: str = None, deadline_seconds: float = None, quorum: int = None,
+                                     on_late_result: Optional[LateResultCallback] = None,
+                                     tier: str = None) -> Dict[str, Any]:
+        """Execute complete multi-AI orchestration analysis, sharing identical in-flight runs
+
+        on_stage, if given, is awaited with (stage, result, duration_seconds) as each stage
+        finishes. Such runs report their own progress and are not coalesced with others, and
+        neither are runs with on_late_result.
+        deadline_seconds is the caller's time budget. Only runs with the same budget are coalesced,
+        and a caller that joins a run in flight shares its absolute deadline, so it may get back
+        fewer finished stages than its own budget would have allowed.
+        ensemble_mode is "llm" or "local" and defaults to ENSEMBLE_MODE.
+        quorum is how many upstream analyses the ensemble waits for (default ENSEMBLE_QUORUM);
+        stages still running then are returned as pending and passed to on_late_result when done.
+        tier is "auto", "fast", "standard" or "deep" and defaults to ANALYSIS_TIER.
+        """
+        
+        tier = self.select_tier(cv_text, tier)
+        ensemble_mode = ensemble_mode or ENSEMBLE_MODE
+        quorum = quorum or ENSEMBLE_QUORUM
+        if tier == "deep":
+            ensemble_mode, quorum = "llm", 3
+        
+        self.active_analyses += 1
+        try:
+            if tier == "fast":
+                runner, args = self._run_fast_analysis, (cv_text, target_role, use_cache, on_stage)
+            else:
+                runner = self._run_multi_ai_analysis
+                args = (cv_text, target_role, use_cache, on_stage, ensemble_mode, quorum, on_late_result)
+            if on_stage is not None or on_late_result is not None:
+                result = await runner(*args)
+            else:
+                key = hashlib.sha256(
+                    json.dumps([cv_text, target_role, use_cache, ensemble_mode, quorum, tier, deadline_seconds]).encode('utf-8')
+                ).hexdigest()
+                result = await self.single_flight.do(key, runner, *args)
+        finally:
+            self.active_analyses -= 1
+        return {**result, "analysis_tier": tier}
+
+    def select_tier(self, cv_text: str, tier: str = None) -> str:
+        """Resolve "auto" (or no tier) to a concrete tier from CV size and current load"""
+        tier = tier or ANALYSIS_TIER
+        if tier != "auto":
+            return tier
+        if estimate_tokens(cv_text) <= FAST_TIER_MAX_CV_TOKENS or self.active_analyses >= FAST_TIER_LOAD_THRESHOLD:
+            return "fast"
+        return "standard"
+
+    async def analyze_cv_fast(self, cv_text: str, target_role: str = None, use_cache: bool = True) -> Dict[str, Any]:
+        """One combined creative, strategic and skills analysis on a low-latency model"""
+        
+        prompt = f"""You are a senior career coach giving a quick but complete CV review.
+
+Analyze this CV from three angles and return one JSON object with exactly these keys:
+
+1. "creative": {{"overall_score": 1-100, "strengths": top 3 strengths, "critical_improvements": specific actionable improvements, "missing_elements": what should be added, "ats_optimization": keywords to add}}
+2. "strategic": {{"analytical_score": 1-100, "strategic_weaknesses": critical gaps, "professional_positioning": how to position the candidate, "executive_summary": a short strategic overview}}
+3. "skills": {{"current_skills_matrix": skills by category, "competitive_gaps": skills missing versus top candidates, "learning_roadmap": a short prioritized plan}}
+
+Keep each list to at most 5 items. Be specific and actionable."""
+
+        cache_key = llm_cache.make_key("fast_combined", self.router.primary("fast"), 0.2, cv_text, target_role)
+        cached = await llm_cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            return cached
+
+        try:
+            content, route = await self.router.complete(
+                "fast",
+                system=CV_ANALYSIS_SYSTEM_PROMPT,
+                prefix=build_cv_prompt_prefix(cv_text, target_role),
+                prompt=prompt,
+                temperature=0.2,
+                max_tokens=1500
+            )
+            
+            try:
+                result = json.loads(content)
+                result["ai_source"] = "Fast Analysis Engine"
+            except:
+                result = {"analysis": content, "ai_source": "Fast Analysis Engine"}
+            return await self._finish(cache_key, "fast", route, result)
+                
+        except Exception as e:
+            logger.error(f"Fast CV analysis error: {e}")
+            return {"error": str(e), "ai_source": "Fast Analysis Engine"}
+
+    async def _run_fast_analysis(self, cv_text: str, target_role: str = None, use_cache: bool = True,
+                                 on_stage: Optional[StageCallback] = None) -> Dict[str, Any]:
+        logger.info("Starting fast-tier CV analysis...")
+        combined = await run_stage("fast_analysis", self.analyze_cv_fast(cv_text, target_role, use_cache), on_stage)
+        
+        # Split the combined answer into the usual per-analysis results
+        results = {}
+        for stage, section in (("gpt4_creative_analysis", "creative"),
+                               ("claude_strategic_analysis", "strategic"),
+                               ("claude_skills_intelligence", "skills")):
+            if "error" in combined:
+                results[stage] = combined
+            elif isinstance(combined.get(section), dict):
+                results[stage] = {**combined[section], "ai_source": "Fast Analysis Engine", "ai_model": combined.get("ai_model")}
+            else:
+                results[stage] = {"analysis": combined.get("analysis", ""), "ai_source": "Fast Analysis Engine"}
+        
+        ensemble_result = await run_stage(
+            "ai_ensemble_insights",
+            self.create_local_ensemble(
+                results["gpt4_creative_analysis"], results["claude_strategic_analysis"],
+                results["claude_skills_intelligence"], target_role
+            ),
+            on_stage,
+            bounded=False
+        )
+        
+        return {
+            **results,
+            "ai_ensemble_insights": ensemble_result,
+            "ensemble_inputs": [stage for stage, result in results.items() if stage_status(result) == "completed"],
+            "analysis_timestamp": datetime.now().isoformat(),
+            "ai_models_used": [combined.get("ai_model", self.router.primary("fast")), ensemble_result.get("ai_source")]
+        }
+
+    @staticmethod
+    async def _await_quorum(tasks: Dict[str, asyncio.Task], quorum: int,
+                            timeout: float = ENSEMBLE_QUORUM_TIMEOUT_SECONDS):
+        """Wait until quorum tasks have succeeded, all have finished, or the timeout passes with one in"""
+        timeout_at = time.monotonic() + timeout if timeout > 0 else None
+        pending = set(tasks.values())
+        while pending:
+            finished = [task for task in tasks.values() if task.done()]
+            if sum(1 for task in finished if stage_status(task.result()) == "completed") >= quorum:
+                return
+            remaining = None if timeout_at is None else timeout_at - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                if finished:
+                    return
+                remaining = None  # nothing to synthesize yet: wait for the first result
+            _, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
 
+    @staticmethod
+    async def _after(first: asyncio.Task, coro: Awaitable):
+        """Await coro once first has finished, whatever its outcome"""
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are an AI ensemble coordinator combining insights from multiple AI systems to provide superior career guidance."},
-                    {"role": "user", "content": ensemble_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=2000
-            )
-            
-            content = response.choices[0].message.content
+            await asyncio.wait([first])
+        except asyncio.CancelledError:
+            coro.close()
+            raise
+        return await coro
+
+    async def _deliver_late_result(self, stage: str, task: asyncio.Task,
+                                   on_late_result: Optional[LateResultCallback]):
+        result = await task
+        if on_late_result is not None:
             try:
-                result = json.loads(content)
-                result["ai_source"] = "Multi-AI Ensemble"
-                return result
-            except:
-                return {"analysis": content, "ai_source": "Multi-AI Ensemble"}
-                
-        except Exception as e:
-            logger.error(f"AI Ensemble error: {e}")
-            return {"error": str(e), "ai_source": "Multi-AI Ensemble"}
+                await on_late_result(stage, result)
+            except Exception as e:
+                logger.error(f"Late result delivery error for {stage}: {e}")
 
-    async def full_multi_ai_analysis(self, cv_text: str, target_role: str = None) -> Dict[str, Any]:
-        """Execute complete multi-AI orchestration analysis"""
+    async def _analyze_in_chunks(self, method, chunks: List[str], target_role: str = None,
+                                 use_cache: bool = True) -> Dict[str, Any]:
+        """Map one analysis over CV sections with bounded parallelism, then reduce the results"""
+        semaphore = asyncio.Semaphore(CV_CHUNK_CONCURRENCY)
         
+        async def analyze_chunk(index: int, chunk: str):
+            async with semaphore:
+                section = f"[Part {index + 1} of {len(chunks)} of a longer CV]\n{chunk}"
+                return await method(section, target_role, use_cache)
+        
+        parts = await asyncio.gather(*[analyze_chunk(i, chunk) for i, chunk in enumerate(chunks)])
+        return merge_partial_analyses(list(parts), chunks)
+
+    async def _run_multi_ai_analysis(self, cv_text: str, target_role: str = None, use_cache: bool = True,
+                                     on_stage: Optional[StageCallback] = None,
+                                     ensemble_mode: str = "llm", quorum: int = ENSEMBLE_QUORUM,
+                                     on_late_result: Optional[LateResultCallback] = None) -> Dict[str, Any]:
         logger.info("Starting Multi-AI Orchestration Analysis...")
         
-        # Run multiple AI analyses
-        gpt4_result = self.analyze_cv_with_gpt4(cv_text, target_role)
-        claude_cv_result = await self.analyze_cv_with_claude(cv_text, target_role)
-        claude_skills_result = await self.analyze_skills_with_claude(cv_text, target_role)
+        # Long CVs are analyzed section by section and the partial results merged
+        chunks = None
+        if estimate_tokens(cv_text) > CHUNKED_ANALYSIS_THRESHOLD_TOKENS:
+            chunks = split_cv_sections(cv_text)
+            logger.info(f"Long CV: analyzing in {len(chunks)} chunks")
         
-        # Create ensemble insights
-        ensemble_result = self.create_ai_ensemble(
-            gpt4_result, claude_cv_result, claude_skills_result, target_role
-        )
+        def analyze(method):
+            if chunks and len(chunks) > 1:
+                return self._analyze_in_chunks(method, chunks, target_role, use_cache)
+            return method(cv_text, target_role, use_cache)
+        
+        # Fan out the independent AI analyses concurrently, leaving time for the LLM ensemble
+        remaining = time_remaining()
+        reserve = 0.0
+        if ensemble_mode == "llm" and remaining is not None:
+            reserve = min(max(remaining, 0) * ENSEMBLE_RESERVE_FRACTION, ENSEMBLE_RESERVE_SECONDS)
+        # Calls sharing the CV prefix on a provider with explicit cache writes wait for the first
+        # one there, so they read its cache entry instead of each writing their own
+        tasks = {}
+        cache_writers = {}
+        for stage, role, method in (
+            ("gpt4_creative_analysis", "creative", self.analyze_cv_with_gpt4),
+            ("claude_strategic_analysis", "strategic", self.analyze_cv_with_claude),
+            ("claude_skills_intelligence", "skills", self.analyze_skills_with_claude),
+        ):
+            coro = analyze(method)
+            provider = self.router.primary(role).split(":", 1)[0]
+            staggered = LLM_PROMPT_CACHING_ENABLED and provider in PROMPT_CACHE_WRITE_PROVIDERS
+            if staggered and provider in cache_writers:
+                coro = self._after(cache_writers[provider], coro)
+            tasks[stage] = asyncio.create_task(run_stage(stage, coro, on_stage, reserve=reserve))
+            if staggered:
+                cache_writers.setdefault(provider, tasks[stage])
+        try:
+            await self._await_quorum(tasks, quorum)
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        
+        # Stages that missed the quorum keep running and are delivered when they land
+        results = {}
+        for stage, task in tasks.items():
+            if task.done():
+                results[stage] = task.result()
+            else:
+                results[stage] = {"pending": True, "error": "Not finished when the ensemble started"}
+                late = asyncio.create_task(self._deliver_late_result(stage, task, on_late_result))
+                self.late_tasks.add(late)
+                late.add_done_callback(self.late_tasks.discard)
+        gpt4_result = results["gpt4_creative_analysis"]
+        claude_cv_result = results["claude_strategic_analysis"]
+        claude_skills_result = results["claude_skills_intelligence"]
+        
+        # Create ensemble insights from the upstream analyses that are in
+        remaining = time_remaining()
+        if ensemble_mode == "llm" and remaining is not None and remaining < ENSEMBLE_MIN_SECONDS:
+            logger.info(f"{max(remaining, 0):.1f}s left for the ensemble: using the local ensemble")
+            ensemble_mode = "local"
+        if ensemble_mode == "local":
+            ensemble = self.create_local_ensemble(gpt4_result, claude_cv_result, claude_skills_result, target_role)
+        else:
+            ensemble = self.create_ai_ensemble(gpt4_result, claude_cv_result, claude_skills_result, target_role, use_cache)
+        ensemble_result = await run_stage("ai_ensemble_insights", ensemble, on_stage, bounded=ensemble_mode != "local")
         
         return {
             "gpt4_creative_analysis": gpt4_result,
             "claude_strategic_analysis": claude_cv_result,
             "claude_skills_intelligence": claude_skills_result,
             "ai_ensemble_insights": ensemble_result,
+            "ensemble_inputs": [stage for stage, result in results.items() if stage_status(result) == "completed"],
             "analysis_timestamp": datetime.now().isoformat(),
-            "ai_models_used": ["GPT-4 Turbo", "Claude-3 Sonnet", "Multi-AI Ensemble"]
+            "ai_models_used": ["GPT-4 Turbo", "Claude-3 Sonnet", ensemble_result.get("ai_source", "Multi-AI Ensemble")]
         }
 
 # Real-Time Company Intelligence Engine
 class CompanyIntelligence:
-    def __init__(self):
+    def __init__(self, collection=companies_collection):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
+        self.collection = collection
+        self.ttl = timedelta(hours=COMPANY_INTEL_TTL_HOURS)
+        self.grace = timedelta(hours=COMPANY_INTEL_GRACE_HOURS)
+        self.refresh_tasks = {}
+        self.single_flight = SingleFlight("Company intelligence")
+
+    @staticmethod
+    def _cache_filter(company_name: str, role_type: str = None) -> Dict[str, Any]:
+        return {"company_key": company_name.strip().lower(), "role_type": role_type}
     
     async def get_company_news(self, company_name: str) -> List[Dict[str, Any]]:
         """Fetch recent company news and developments"""
@@ -334,17 +2077,14 @@ Based on your knowledge, analyze:
 Return as detailed JSON. Be specific and actionable."""
 
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are a company research specialist with deep knowledge of corporate cultures and hiring practices."},
-                    {"role": "user", "content": prompt}
-                ],
+            content, _ = await provider_router.complete(
+                "company",
+                system="You are a company research specialist with deep knowledge of corporate cultures and hiring practices.",
+                prompt=prompt,
                 temperature=0.2,
                 max_tokens=2000
             )
             
-            content = response.choices[0].message.content
             try:
                 return json.loads(content)
             except:
@@ -354,13 +2094,9 @@ Return as detailed JSON. Be specific and actionable."""
             logger.error(f"Company culture analysis error: {e}")
             return {"error": str(e)}
     
-    async def get_comprehensive_intelligence(self, company_name: str, role_type: str = None) -> Dict[str, Any]:
-        """Get comprehensive company intelligence"""
+    async def analyze_industry_context(self, company_name: str, role_type: str = None) -> Dict[str, Any]:
+        """Analyze the industry context around a company for a given role"""
         
-        news = await self.get_company_news(company_name)
-        culture = await self.analyze_company_culture(company_name)
-        
-        # Industry context analysis
         industry_prompt = f"""Provide industry context for someone applying to {company_name} for a {role_type or 'professional'} role.
 
 Include:
@@ -373,17 +2109,14 @@ Include:
 Return as JSON."""
 
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are an industry analyst providing market intelligence."},
-                    {"role": "user", "content": industry_prompt}
-                ],
+            industry_content, _ = await provider_router.complete(
+                "company",
+                system="You are an industry analyst providing market intelligence.",
+                prompt=industry_prompt,
                 temperature=0.3,
                 max_tokens=2000
             )
             
-            industry_content = response.choices[0].message.content
             try:
                 industry_analysis = json.loads(industry_content)
             except:
@@ -392,6 +2125,18 @@ Return as JSON."""
         except Exception as e:
             industry_analysis = {"error": str(e)}
         
+        return industry_analysis
+    
+    async def get_comprehensive_intelligence(self, company_name: str, role_type: str = None) -> Dict[str, Any]:
+        """Get comprehensive company intelligence"""
+        
+        # The news, culture and industry stages are independent, so run them concurrently
+        news, culture, industry_analysis = await asyncio.gather(
+            self.get_company_news(company_name),
+            self.analyze_company_culture(company_name),
+            self.analyze_industry_context(company_name, role_type)
+        )
+        
         return {
             "company_name": company_name,
             "recent_news": news,
@@ -400,121 +2145,603 @@ Return as JSON."""
             "last_updated": datetime.now().isoformat()
         }
 
+    async def _store_intelligence(self, company_name: str, role_type: str, intelligence: Dict[str, Any]):
+        """Upsert intelligence into companies_collection unless a stage failed"""
+        if "error" in intelligence["culture_analysis"] or "error" in intelligence["industry_context"]:
+            return
+        try:
+            await self.collection.update_one(
+                self._cache_filter(company_name, role_type),
+                {"$set": {
+                    "company_name": company_name,
+                    "intelligence": intelligence,
+                    "last_updated": datetime.now()
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Company intelligence store error: {e}")
+
+    async def _refresh(self, company_name: str, role_type: str = None) -> Dict[str, Any]:
+        key = json.dumps([company_name.strip().lower(), role_type])
+        return await self.single_flight.do(key, self._fetch_and_store, company_name, role_type)
+
+    async def _fetch_and_store(self, company_name: str, role_type: str = None) -> Dict[str, Any]:
+        intelligence = await self.get_comprehensive_intelligence(company_name, role_type)
+        await self._store_intelligence(company_name, role_type, intelligence)
+        return intelligence
+
+    def _refresh_in_background(self, company_name: str, role_type: str = None):
+        key = (company_name.strip().lower(), role_type)
+        if key in self.refresh_tasks:
+            return
+
+        async def refresh():
+            try:
+                await self._refresh(company_name, role_type)
+                logger.info(f"Refreshed stale company intelligence for {company_name}")
+            except Exception as e:
+                logger.error(f"Background company refresh error: {e}")
+
+        task = asyncio.create_task(refresh())
+        self.refresh_tasks[key] = task
+        task.add_done_callback(lambda _: self.refresh_tasks.pop(key, None))
+
+    async def get_cached_intelligence(self, company_name: str, role_type: str = None, force_refresh: bool = False) -> Dict[str, Any]:
+        """Read-through company intelligence with stale-while-revalidate"""
+        doc = None
+        if not force_refresh:
+            try:
+                doc = await self.collection.find_one(self._cache_filter(company_name, role_type))
+            except Exception as e:
+                logger.warning(f"Company intelligence cache read error: {e}")
+
+        if doc and doc.get("intelligence") and isinstance(doc.get("last_updated"), datetime):
+            age = datetime.now() - doc["last_updated"]
+            if age < self.ttl:
+                return {**doc["intelligence"], "cache_status": "fresh"}
+            if age < self.ttl + self.grace:
+                self._refresh_in_background(company_name, role_type)
+                return {**doc["intelligence"], "cache_status": "stale"}
+
+        intelligence = await self._refresh(company_name, role_type)
+        return {**intelligence, "cache_status": "miss"}
+
 # Initialize AI services
 ai_orchestrator = AIOrchestrator()
 company_intel = CompanyIntelligence()
 
-def extract_text_from_pdf(pdf_file) -> str:
-    """Extract text from uploaded PDF"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    except Exception as e:
-        logger.error(f"PDF extraction error: {e}")
-        return ""
+# Analysis job queue settings
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'mongo')  # "mongo" or "memory"
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY_SECONDS = float(os.environ.get('JOB_RETRY_DELAY_SECONDS', '30'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '900'))
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_INTERVAL_SECONDS', '2'))
+# Time budget of one queued analysis, instead of the interactive default; keep it under the
+# lease so a running job is not reclaimed by another worker (0 means no deadline)
+JOB_ANALYSIS_DEADLINE_SECONDS = float(os.environ.get('JOB_ANALYSIS_DEADLINE_SECONDS', '600'))
+
+class InMemoryJobStore:
+    """Process-local job store, for tests and single-node development"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    async def ensure_indexes(self):
+        pass
+
+    async def insert(self, job: Dict[str, Any]):
+        self.jobs[job["job_id"]] = copy.deepcopy(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        return copy.deepcopy(job) if job else None
+
+    async def claim(self, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        now = datetime.now()
+        candidates = [
+            job for job in self.jobs.values()
+            if (job["status"] == "queued" and job["available_at"] <= now)
+            or (job["status"] == "running" and job["lease_expires_at"] < now)
+        ]
+        if not candidates:
+            return None
+        job = min(candidates, key=lambda j: (-j["priority"], j["created_at"]))
+        job.update({
+            "status": "running",
+            "attempts": job["attempts"] + 1,
+            "started_at": now,
+            "updated_at": now,
+            "lease_expires_at": now + timedelta(seconds=lease_seconds)
+        })
+        return copy.deepcopy(job)
+
+    async def update(self, job_id: str, fields: Dict[str, Any]):
+        self.jobs[job_id].update(fields)
+
+class MongoJobStore:
+    """Job store on a MongoDB collection, so queued work survives restarts and is shared by workers"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("job_id", unique=True)
+        await self.collection.create_index([("status", 1), ("priority", -1), ("created_at", 1)])
 
-def extract_text_from_docx(docx_file) -> str:
-    """Extract text from uploaded DOCX file"""
+    async def insert(self, job: Dict[str, Any]):
+        await self.collection.insert_one(dict(job))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"job_id": job_id}, {"_id": 0})
+
+    async def claim(self, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        now = datetime.now()
+        # Queued jobs that are due, or running jobs whose worker died without finishing
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "available_at": {"$lte": now}},
+                {"status": "running", "lease_expires_at": {"$lt": now}}
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "started_at": now,
+                    "updated_at": now,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def update(self, job_id: str, fields: Dict[str, Any]):
+        await self.collection.update_one({"job_id": job_id}, {"$set": fields})
+
+class AnalysisJobQueue:
+    """Background workers that run queued CV analyses and record their outcome"""
+
+    def __init__(self, store, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retry_delay: float = JOB_RETRY_DELAY_SECONDS, lease_seconds: float = JOB_LEASE_SECONDS,
+                 poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_tasks = []
+        self.wakeup = asyncio.Event()
+
+    async def submit(self, request: AnalysisJobRequest) -> Dict[str, Any]:
+        now = datetime.now()
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "analysis_id": str(uuid.uuid4()),
+            "status": "queued",
+            "priority": request.priority,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "request": request.model_dump(exclude={"priority"}),
+            "error": None,
+            "partial": None,
+            "stage_status": None,
+            "created_at": now,
+            "updated_at": now,
+            "available_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "lease_expires_at": None
+        }
+        await self.store.insert(job)
+        self.wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.store.get(job_id)
+
+    async def start(self):
+        for n in range(self.workers):
+            self.worker_tasks.append(asyncio.create_task(self._worker(n)))
+        logger.info(f"Started {self.workers} analysis job workers")
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    async def _worker(self, n: int):
+        while True:
+            try:
+                job = await self.store.claim(self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Job worker {n} claim error: {e}")
+                job = None
+
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(job)
+            except Exception as e:
+                # The job keeps its lease and is reclaimed once it expires
+                logger.error(f"Job worker {n} failed to record job {job['job_id']}: {e}")
+
+    async def _process(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        if job["attempts"] > job["max_attempts"]:
+            await self.store.update(job_id, {
+                "status": "failed",
+                "error": job.get("error") or "Exceeded retry limit",
+                "finished_at": datetime.now(),
+                "updated_at": datetime.now()
+            })
+            return
+
+        try:
+            request = CVAnalysisRequest(**job["request"])
+            response = await run_cv_analysis(
+                request,
+                analysis_id=job["analysis_id"],
+                default_deadline_seconds=JOB_ANALYSIS_DEADLINE_SECONDS,
+                max_deadline_seconds=JOB_ANALYSIS_DEADLINE_SECONDS
+            )
+            await self.store.update(job_id, {
+                "status": "completed",
+                "partial": response.partial,
+                "stage_status": response.stage_status,
+                "error": None,
+                "finished_at": datetime.now(),
+                "updated_at": datetime.now()
+            })
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} attempt {job['attempts']} failed: {e}")
+            now = datetime.now()
+            if job["attempts"] >= job["max_attempts"]:
+                fields = {"status": "failed", "finished_at": now}
+            else:
+                # Back off exponentially before the next attempt
+                delay = self.retry_delay * (2 ** (job["attempts"] - 1))
+                fields = {"status": "queued", "available_at": now + timedelta(seconds=delay)}
+            await self.store.update(job_id, {**fields, "error": str(e), "updated_at": now})
+
+job_queue = AnalysisJobQueue(InMemoryJobStore() if JOB_BACKEND == 'memory' else MongoJobStore(jobs_collection))
+
+# PDF extraction budget: nothing past these limits is ever sent to an LLM
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '30'))
+PDF_MAX_CHARS = int(os.environ.get('PDF_MAX_CHARS', '60000'))
+# PDFs with at least this many pages are split into page ranges extracted in parallel
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', '8'))
+PDF_PAGES_PER_CHUNK = int(os.environ.get('PDF_PAGES_PER_CHUNK', '4'))
+PDF_SLOW_PAGE_SECONDS = float(os.environ.get('PDF_SLOW_PAGE_SECONDS', '1.0'))
+
+# CV text extraction settings
+EXTRACTION_POOL_SIZE = int(os.environ.get('EXTRACTION_POOL_SIZE', str(min(4, os.cpu_count() or 1))))
+EXTRACTION_TIMEOUT_SECONDS = float(os.environ.get('EXTRACTION_TIMEOUT_SECONDS', '30'))
+EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', '1024'))
+
+def detect_file_type(filename: str) -> Optional[str]:
+    """Map an uploaded filename to the parser that handles it (None means unknown)"""
+    filename_lower = filename.lower()
+    if filename_lower.endswith('.pdf'):
+        return "pdf"
+    if filename_lower.endswith('.docx'):
+        return "docx"
+    if filename_lower.endswith('.doc'):
+        return "doc"
+    if filename_lower.endswith(('.txt', '.text')):
+        return "text"
+    return None
+
+class ExtractionTimeout(Exception):
+    pass
+
+class ExtractionBudget:
+    """Wall-clock budget of one document, started when its first job is taken by a worker"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deadline = None
+
+    def start(self) -> float:
+        """Start the clock if it isn't running yet; returns the seconds left"""
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.seconds
+        return self.deadline - time.monotonic()
+
+class ExtractionService:
+    """Runs the CPU-bound CV parsers in worker processes with a per-document wall-clock timeout
+
+    Each worker is its own single-process executor and a job only goes to an idle one, so time
+    spent waiting for a worker never counts against a document's budget, and a parser that
+    overruns is stopped by killing and replacing just its worker.
+    """
+
+    def __init__(self, pool_size: int = EXTRACTION_POOL_SIZE, timeout: float = EXTRACTION_TIMEOUT_SECONDS,
+                 memory_limit_mb: int = EXTRACTION_MEMORY_LIMIT_MB):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.idle_workers = None
+        self.workers = []
+        self.stats = {"completed": 0, "timeouts": 0, "worker_restarts": 0}
+
+    def _new_worker(self) -> ProcessPoolExecutor:
+        worker = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=limit_extraction_memory,
+            initargs=(self.memory_limit_mb,)
+        )
+        self.workers.append(worker)
+        return worker
+
+    def _get_idle_workers(self) -> asyncio.Queue:
+        if self.idle_workers is None:
+            self.idle_workers = asyncio.Queue()
+            for _ in range(self.pool_size):
+                self.idle_workers.put_nowait(self._new_worker())
+        return self.idle_workers
+
+    def _replace_worker(self, worker: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """Kill one worker, the only way to stop a parser that is stuck mid-document"""
+        self.stats["worker_restarts"] += 1
+        for process in list(getattr(worker, "_processes", {}).values()):
+            process.terminate()
+        worker.shutdown(wait=False, cancel_futures=True)
+        self.workers.remove(worker)
+        return self._new_worker()
+
+    async def run(self, func, *args, budget: ExtractionBudget = None):
+        """Run func(*args) in the next idle worker, within budget (a fresh one if not given)"""
+        budget = budget or ExtractionBudget(self.timeout)
+        idle_workers = self._get_idle_workers()
+        worker = await idle_workers.get()
+        try:
+            remaining = budget.start()
+            if remaining <= 0:
+                raise ExtractionTimeout(f"Extraction exceeded {budget.seconds:.0f}s")
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(worker.submit(func, *args)), remaining)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                worker = self._replace_worker(worker)
+                raise ExtractionTimeout(f"Extraction exceeded {budget.seconds:.0f}s")
+            except BrokenProcessPool:
+                # The parser took its worker down (e.g. at the memory limit)
+                worker = self._replace_worker(worker)
+                raise
+        finally:
+            idle_workers.put_nowait(worker)
+        self.stats["completed"] += 1
+        return result
+
+    async def extract(self, source, file_type: str):
+        """Extract a document's text from bytes or a file path; returns (text, extraction metadata)"""
+        started = time.perf_counter()
+        budget = ExtractionBudget(self.timeout)
+        if file_type == "pdf":
+            text, metadata = await self._extract_pdf(source, budget)
+        else:
+            text = await self.run(extract_text_from_source, source, file_type, budget=budget)
+            metadata = {"parser": "python-docx" if file_type == "docx" else "docx2txt"}
+        metadata["seconds"] = round(time.perf_counter() - started, 3)
+        return text, metadata
+
+    async def _extract_pdf(self, source, budget: ExtractionBudget):
+        # The first range also tells us the page count, so small PDFs take a single round-trip.
+        # All page ranges of the document share one budget.
+        first = await self.run(extract_pdf_pages, source, 0, PDF_PAGES_PER_CHUNK, PDF_MAX_CHARS, budget=budget)
+        results = [first]
+        page_limit = min(first["page_count"], PDF_MAX_PAGES)
+        remaining_chars = PDF_MAX_CHARS - len(first["text"])
+
+        if page_limit > PDF_PAGES_PER_CHUNK and remaining_chars > 0:
+            if page_limit >= PDF_PARALLEL_MIN_PAGES:
+                ranges = [
+                    (start, min(start + PDF_PAGES_PER_CHUNK, page_limit))
+                    for start in range(PDF_PAGES_PER_CHUNK, page_limit, PDF_PAGES_PER_CHUNK)
+                ]
+            else:
+                ranges = [(PDF_PAGES_PER_CHUNK, page_limit)]
+            results += await asyncio.gather(*[
+                self.run(extract_pdf_pages, source, start, end, remaining_chars, budget=budget)
+                for start, end in ranges
+            ])
+
+        # Page breaks stay as form feeds so normalize_cv_text can tell headers and footers apart
+        text = "\f".join(result["text"] for result in results if result["text"])
+        pages = [page for result in results for page in result["pages"]]
+        truncated = len(text) > PDF_MAX_CHARS or first["page_count"] > page_limit
+        text = text[:PDF_MAX_CHARS]
+
+        slowest = max(pages, key=lambda page: page["ms"]) if pages else None
+        if slowest and slowest["ms"] > PDF_SLOW_PAGE_SECONDS * 1000:
+            logger.warning(f"Slow PDF page: page {slowest['page']} took {slowest['ms']}ms")
+
+        return text, {
+            "parser": "pypdf2",
+            "page_count": first["page_count"],
+            "pages_extracted": len(pages),
+            "truncated": truncated,
+            "slowest_page": slowest,
+            "page_timings": pages
+        }
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown(wait=False, cancel_futures=True)
+        self.workers = []
+        self.idle_workers = None
+
+extraction_service = ExtractionService()
+
+# Extracted-text cache, keyed by the SHA-256 of the uploaded bytes
+TEXT_CACHE_MAX_ENTRIES = int(os.environ.get('TEXT_CACHE_MAX_ENTRIES', '256'))
+TEXT_CACHE_TTL_SECONDS = int(os.environ.get('TEXT_CACHE_TTL_SECONDS', str(7 * 86400)))
+TEXT_CACHE_MONGO_ENABLED = os.environ.get('TEXT_CACHE_MONGO_ENABLED', 'false').lower() == 'true'
+
+text_cache = TieredCache(
+    "Extracted text", extracted_texts_collection,
+    TEXT_CACHE_MAX_ENTRIES, TEXT_CACHE_TTL_SECONDS, TEXT_CACHE_MONGO_ENABLED
+)
+
+@app.on_event("startup")
+async def startup_provider_clients():
+    await provider_clients.start()
+
+@app.on_event("startup")
+async def startup_indexes():
     try:
-        doc = docx.Document(docx_file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        if llm_cache.mongo_enabled:
+            await llm_cache.ensure_indexes()
+        if text_cache.mongo_enabled:
+            await text_cache.ensure_indexes()
+        await companies_collection.create_index([("company_key", 1), ("role_type", 1)])
+        await analyses_collection.create_index("analysis_id")
     except Exception as e:
-        logger.error(f"DOCX extraction error: {e}")
-        return ""
+        logger.warning(f"Could not create MongoDB indexes: {e}")
 
-def extract_text_from_doc(doc_file) -> str:
-    """Extract text from uploaded DOC file"""
+@app.on_event("startup")
+async def startup_job_queue():
     try:
-        # Reset file pointer to beginning
-        doc_file.seek(0)
-        text = docx2txt.process(doc_file)
-        return text if text else ""
+        await job_queue.store.ensure_indexes()
     except Exception as e:
-        logger.error(f"DOC extraction error: {e}")
-        # Try alternative approach - treat as binary and extract readable text
-        try:
-            doc_file.seek(0)
-            content = doc_file.read()
-            # Simple text extraction for basic DOC files
-            text = content.decode('utf-8', errors='ignore')
-            # Clean up the text
-            import re
-            text = re.sub(r'[\x00-\x1f\x7f-\x9f]', ' ', text)  # Remove control characters
-            text = ' '.join(text.split())  # Normalize whitespace
-            return text if len(text) > 50 else ""  # Only return if we got substantial text
-        except Exception as e2:
-            logger.error(f"Alternative DOC extraction error: {e2}")
-            return ""
+        logger.warning(f"Could not create job indexes: {e}")
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_job_queue():
+    await job_queue.stop()
+
+@app.on_event("shutdown")
+async def shutdown_provider_clients():
+    await provider_clients.close()
+
+@app.on_event("shutdown")
+async def shutdown_database():
+    database.close()
+
+@app.on_event("shutdown")
+async def shutdown_extraction_service():
+    extraction_service.shutdown()
 
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "JobPrep AI - Multi-AI Orchestration"}
 
-@app.post("/api/upload-cv")
-async def upload_cv(file: UploadFile = File(...)):
-    """Upload and extract text from CV (supports PDF, DOCX, DOC, and text files)"""
-    try:
-        content = await file.read()
-        filename_lower = file.filename.lower()
-        
-        logger.info(f"Processing file: {file.filename} (type: {file.content_type})")
-        
-        if filename_lower.endswith('.pdf'):
-            # Handle PDF files
-            pdf_file = io.BytesIO(content)
-            cv_text = extract_text_from_pdf(pdf_file)
-        elif filename_lower.endswith('.docx'):
-            # Handle DOCX files
-            docx_file = io.BytesIO(content)
-            cv_text = extract_text_from_docx(docx_file)
-        elif filename_lower.endswith('.doc'):
-            # Handle DOC files with improved error handling
-            doc_file = io.BytesIO(content)
-            cv_text = extract_text_from_doc(doc_file)
-            if not cv_text:
-                # If DOC extraction fails, suggest conversion
-                raise HTTPException(
-                    status_code=400,
-                    detail="Could not extract text from this DOC file. For best results, please save your document as DOCX format and try again, or copy and paste the text into a text file."
-                )
-        elif filename_lower.endswith(('.txt', '.text')):
-            # Handle text files
-            cv_text = content.decode('utf-8')
+@app.get("/api/providers/status")
+async def provider_status():
+    """Routing table, per-model latency and circuit state, and per-provider rate limiter state"""
+    return {**provider_router.get_stats(), "rate_limits": provider_clients.get_stats()}
+
+@app.post("/api/providers/fake")
+async def configure_fake_provider(faults: FakeProviderFaults):
+    """Inject latency and failures into a fake model (only when FAKE_PROVIDER_ENABLED)"""
+    if provider_clients.fake is None:
+        raise HTTPException(status_code=404, detail="Fake provider is not enabled")
+    provider_clients.fake.configure(faults.model, faults.latency_seconds, faults.failure_rate)
+    return {"model": faults.model, **provider_clients.fake.faults[faults.model]}
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the response caches"""
+    return {
+        "llm_responses": llm_cache.get_stats(),
+        "extracted_texts": text_cache.get_stats(),
+        "provider_prefix_cache": provider_clients.prefix_cache.get_stats(),
+        "single_flight": {
+            "multi_ai_analysis": ai_orchestrator.single_flight.get_stats(),
+            "company_intelligence": company_intel.single_flight.get_stats()
+        }
+    }
+
+async def extract_uploaded_cv(file: UploadFile) -> Dict[str, Any]:
+    """Check an uploaded CV against the size limit and extract its text (raises HTTPException)"""
+    upload = await SpooledUpload.from_upload(file)
+    return await extract_spooled_cv(upload, file.filename, file.content_type)
+
+async def extract_spooled_cv(upload: SpooledUpload, filename: str, content_type: str = None) -> Dict[str, Any]:
+    """Extract the text of an already spooled CV upload (raises HTTPException)"""
+    file_type = detect_file_type(filename)
+    extraction = {}
+    cache_hit = False
+    
+    logger.info(f"Processing file: {filename} (type: {content_type}, {upload.size} bytes)")
+    
+    if file_type in ("pdf", "docx", "doc"):
+        # Repeat uploads of the same bytes are served without touching the parsers
+        cached = await text_cache.get(upload.sha256)
+        if cached is not None and cached["file_type"] == file_type:
+            cv_text, extraction, cache_hit = cached["text"], cached["extraction"], True
         else:
-            # Try to decode as text as fallback
+            # Parse binary documents in the extraction pool so the event loop stays free
             try:
-                cv_text = content.decode('utf-8')
-                logger.info(f"Fallback: Treated {file.filename} as text file")
-            except UnicodeDecodeError:
+                cv_text, extraction = await extraction_service.extract(upload.source, file_type)
+            except ExtractionTimeout:
                 raise HTTPException(
-                    status_code=400, 
-                    detail=f"Unsupported file format. Please upload PDF, DOCX, DOC, or text files. File type: {file.content_type}"
+                    status_code=400,
+                    detail="This file took too long to process. Please upload a smaller or simpler document, or paste the text into a text file."
                 )
-        
-        if not cv_text or not cv_text.strip():
+            if cv_text and cv_text.strip():
+                await text_cache.set(upload.sha256, {
+                    "text": cv_text,
+                    "file_type": file_type,
+                    "extraction": extraction
+                })
+        if file_type == "doc" and not cv_text:
+            # If DOC extraction fails, suggest conversion
+            raise HTTPException(
+                status_code=400,
+                detail="Could not extract text from this DOC file. For best results, please save your document as DOCX format and try again, or copy and paste the text into a text file."
+            )
+    elif file_type == "text":
+        # Handle text files
+        cv_text = upload.read_bytes().decode('utf-8')
+    else:
+        # Try to decode as text as fallback
+        try:
+            cv_text = upload.read_bytes().decode('utf-8')
+            file_type = "text"
+            logger.info(f"Fallback: Treated {filename} as text file")
+        except UnicodeDecodeError:
             raise HTTPException(
                 status_code=400, 
-                detail="Could not extract text from CV. Please ensure the file contains readable text."
+                detail=f"Unsupported file format. Please upload PDF, DOCX, DOC, or text files. File type: {content_type}"
             )
-        
-        logger.info(f"Successfully extracted {len(cv_text)} characters from {file.filename}")
-        
-        return {
-            "success": True,
-            "cv_text": cv_text,
-            "filename": file.filename,
-            "length": len(cv_text),
-            "file_type": "pdf" if filename_lower.endswith('.pdf') 
-                        else "docx" if filename_lower.endswith('.docx')
-                        else "doc" if filename_lower.endswith('.doc')
-                        else "text"
-        }
+    
+    if not cv_text or not cv_text.strip():
+        raise HTTPException(
+            status_code=400, 
+            detail="Could not extract text from CV. Please ensure the file contains readable text."
+        )
+    
+    logger.info(f"Successfully extracted {len(cv_text)} characters from {filename}")
+    
+    return {
+        "success": True,
+        "cv_text": cv_text,
+        "filename": filename,
+        "length": len(cv_text),
+        "file_type": file_type,
+        "extraction": extraction,
+        "cache_hit": cache_hit
+    }
+
+@app.post("/api/upload-cv")
+async def upload_cv(file: UploadFile = File(...)):
+    """Upload and extract text from CV (supports PDF, DOCX, DOC, and text files)"""
+    try:
+        return await extract_uploaded_cv(file)
         
     except HTTPException:
         raise
@@ -522,87 +2749,626 @@ async def upload_cv(file: UploadFile = File(...)):
         logger.error(f"CV upload error: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing CV: {str(e)}")
 
+# CV normalization before prompting: every token sent costs latency and money on four prompts
+CV_TOKEN_BUDGET = int(os.environ.get('CV_TOKEN_BUDGET', '16000'))  # 0 disables trimming
+CV_BOILERPLATE_MAX_LINE_CHARS = 80
+# Non-empty lines at the top and at the bottom of each page checked for running headers/footers
+CV_PAGE_EDGE_LINES = 2
+
+PAGE_NUMBER_LINE = re.compile(r'^(page\s*)?\d{1,3}(\s*(of|/)\s*\d{1,3})?$')
+
+def estimate_tokens(text: str) -> int:
+    """Local token estimate: ~4 characters or ~0.75 words per token, whichever is larger"""
+    if not text:
+        return 0
+    return max((len(text) + 3) // 4, round(len(text.split()) * 4 / 3))
+
+def page_edge_signature(line: str) -> str:
+    """Compare headers/footers case-insensitively, ignoring the number in e.g. 'Jane Doe - Page 2'"""
+    signature = line.lower()
+    if re.search(r'\bpage\s*\d', signature):
+        signature = re.sub(r'\d+', '#', signature)
+    return signature
+
+def strip_page_boilerplate(pages: List[List[str]]) -> Tuple[List[str], int]:
+    """Drop page numbers and running headers/footers from the top and bottom of each page.
+
+    A short edge line counts as boilerplate only when it also sits at the edge of another page;
+    its first occurrence is kept, so a name repeated as a header still appears once. Lines in
+    the body of a page are never dropped. Returns (lines, lines_removed).
+    """
+    def edge_indexes(page):
+        filled = [i for i, line in enumerate(page) if line and len(line) <= CV_BOILERPLATE_MAX_LINE_CHARS]
+        return set(filled[:CV_PAGE_EDGE_LINES] + filled[-CV_PAGE_EDGE_LINES:])
+
+    edges = [edge_indexes(page) for page in pages]
+    pages_by_signature = {}
+    for number, (page, indexes) in enumerate(zip(pages, edges)):
+        for i in indexes:
+            pages_by_signature.setdefault(page_edge_signature(page[i]), set()).add(number)
+
+    lines = []
+    kept = set()
+    removed = 0
+    for page, indexes in zip(pages, edges):
+        for i, line in enumerate(page):
+            if i in indexes:
+                signature = page_edge_signature(line)
+                if PAGE_NUMBER_LINE.match(line.lower()) or (
+                        len(pages_by_signature[signature]) > 1 and signature in kept):
+                    removed += 1
+                    continue
+                kept.add(signature)
+            lines.append(line)
+    return lines, removed
+
+def normalize_cv_text(text: str, token_budget: int = CV_TOKEN_BUDGET):
+    """Strip control characters, whitespace runs and repeated page boilerplate, then trim to the
+    token budget. Returns (normalized_text, stats)."""
+    tokens_before = estimate_tokens(text)
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    # Extracted PDFs separate pages with form feeds; boilerplate is only looked for across them
+    pages = []
+    for page in text.split('\f'):
+        page = re.sub(r'[\x00-\x08\x0b-\x1f\x7f-\x9f]', ' ', page)
+        pages.append([re.sub(r'[ \t\u00a0]+', ' ', line).strip() for line in page.split('\n')])
+    if len(pages) > 1:
+        lines, boilerplate_removed = strip_page_boilerplate(pages)
+    else:
+        lines, boilerplate_removed = pages[0], 0
+    text = re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+    truncated = False
+    if token_budget and estimate_tokens(text) > token_budget:
+        # Cut on a line boundary near the budget; the head of a CV carries the most signal
+        cut = text.rfind('\n', 0, token_budget * 4)
+        text = text[:cut if cut > 0 else token_budget * 4].rstrip()
+        while estimate_tokens(text) > token_budget and '\n' in text:
+            text = text[:text.rfind('\n')].rstrip()
+        truncated = True
+
+    tokens_after = estimate_tokens(text)
+    return text, {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "boilerplate_lines_removed": boilerplate_removed,
+        "truncated": truncated,
+        "token_budget": token_budget
+    }
+
+# Map-reduce analysis for long CVs: above the threshold each upstream analysis runs per section
+CHUNKED_ANALYSIS_THRESHOLD_TOKENS = int(os.environ.get('CHUNKED_ANALYSIS_THRESHOLD_TOKENS', '3500'))
+CV_CHUNK_TOKENS = int(os.environ.get('CV_CHUNK_TOKENS', '2000'))
+CV_CHUNK_CONCURRENCY = int(os.environ.get('CV_CHUNK_CONCURRENCY', '4'))
+MERGED_LIST_MAX_ITEMS = 12
+
+def split_cv_sections(cv_text: str, max_tokens: int = CV_CHUNK_TOKENS) -> List[str]:
+    """Split a CV on blank lines into chunks of whole sections, each within max_tokens"""
+    blocks = []
+    for block in re.split(r'\n\s*\n', cv_text):
+        if estimate_tokens(block) <= max_tokens:
+            blocks.append(block)
+            continue
+        # A single oversized section is split on line boundaries instead
+        current = []
+        for line in block.split('\n'):
+            if current and estimate_tokens('\n'.join(current + [line])) > max_tokens:
+                blocks.append('\n'.join(current))
+                current = []
+            current.append(line)
+        if current:
+            blocks.append('\n'.join(current))
+
+    chunks = []
+    current = []
+    for block in blocks:
+        if current and estimate_tokens('\n\n'.join(current + [block])) > max_tokens:
+            chunks.append('\n\n'.join(current))
+            current = []
+        current.append(block)
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+# Ensemble input: "compact" sends only the fields the ensemble reasons over, "full" the raw analyses
+ENSEMBLE_INPUT_MODE = os.environ.get('ENSEMBLE_INPUT_MODE', 'compact')
+ENSEMBLE_MAX_LIST_ITEMS = int(os.environ.get('ENSEMBLE_MAX_LIST_ITEMS', '5'))
+ENSEMBLE_MAX_TEXT_CHARS = int(os.environ.get('ENSEMBLE_MAX_TEXT_CHARS', '300'))
+ENSEMBLE_INPUT_FIELDS = {
+    "gpt4_creative": ["overall_score", "strengths", "critical_improvements", "missing_elements"],
+    "claude_strategic": ["analytical_score", "strategic_weaknesses", "competitive_analysis",
+                         "professional_positioning", "executive_summary"],
+    "claude_skills": ["competitive_gaps", "market_demand_analysis", "learning_roadmap",
+                      "certification_recommendations"],
+}
+
+def compact_value(value: Any, depth: int = 0) -> Any:
+    """Cap a value's size: truncate text, keep the first few list items and object keys"""
+    if isinstance(value, str):
+        if len(value) > ENSEMBLE_MAX_TEXT_CHARS:
+            return value[:ENSEMBLE_MAX_TEXT_CHARS].rstrip() + "..."
+        return value
+    if isinstance(value, list):
+        return [compact_value(item, depth + 1) for item in value[:ENSEMBLE_MAX_LIST_ITEMS]]
+    if isinstance(value, dict):
+        if depth >= 2:
+            return compact_value(json.dumps(value, separators=(',', ':'), default=str), depth)
+        items = list(value.items())[:ENSEMBLE_MAX_LIST_ITEMS]
+        return {k: compact_value(v, depth + 1) for k, v in items}
+    return value
+
+def compact_analysis(analysis: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Reduce one upstream analysis to the fields the ensemble needs"""
+    if "error" in analysis:
+        return {"error": compact_value(analysis["error"])}
+    compact = {field: compact_value(analysis[field]) for field in fields if field in analysis}
+    if not compact and "analysis" in analysis:
+        # Unparsed free-text responses are passed on truncated
+        compact["analysis"] = compact_value(analysis["analysis"])
+    return compact
+
+def build_ensemble_input(analyses: Dict[str, Dict[str, Any]], mode: str = None) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Render the upstream analyses for the ensemble prompt, returning (sections, stats)"""
+    mode = mode or ENSEMBLE_INPUT_MODE
+    full = {name: json.dumps(analysis, indent=2) for name, analysis in analyses.items()}
+    full_tokens = sum(estimate_tokens(text) for text in full.values())
+    if mode != "compact":
+        return full, {"mode": "full", "input_tokens": full_tokens, "full_tokens": full_tokens, "tokens_saved": 0}
+
+    sections = {
+        name: json.dumps(compact_analysis(analysis, ENSEMBLE_INPUT_FIELDS[name]), separators=(',', ':'), default=str)
+        for name, analysis in analyses.items()
+    }
+    input_tokens = sum(estimate_tokens(text) for text in sections.values())
+    return sections, {
+        "mode": "compact",
+        "input_tokens": input_tokens,
+        "full_tokens": full_tokens,
+        "tokens_saved": max(full_tokens - input_tokens, 0),
+    }
+
+def merge_partial_values(values: List[Any], weights: List[float]) -> Any:
+    """Merge one field across per-chunk results: weighted mean for numbers, de-duplicated
+    concatenation for lists and text, recursive merge for objects"""
+    present = [(v, w) for v, w in zip(values, weights) if v is not None]
+    if not present:
+        return None
+    values = [v for v, _ in present]
+    weights = [w for _, w in present]
+
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        total = sum(weights) or len(values)
+        return round(sum(v * w for v, w in zip(values, weights)) / total, 1)
+    if all(isinstance(v, dict) for v in values):
+        keys = list(dict.fromkeys(k for v in values for k in v))
+        return {k: merge_partial_values([v.get(k) for v in values], weights) for k in keys}
+    if all(isinstance(v, list) for v in values):
+        merged = []
+        seen = set()
+        for item in (item for v in values for item in v):
+            signature = json.dumps(item, sort_keys=True, default=str).lower()
+            if signature not in seen:
+                seen.add(signature)
+                merged.append(item)
+        return merged[:MERGED_LIST_MAX_ITEMS]
+    texts = list(dict.fromkeys(v if isinstance(v, str) else json.dumps(v, default=str) for v in values))
+    return "\n\n".join(texts)
+
+def merge_partial_analyses(parts: List[Dict[str, Any]], chunks: List[str]) -> Dict[str, Any]:
+    """Reduce per-chunk analyses into one result with the same schema as a single-prompt run"""
+    succeeded = [(part, chunk) for part, chunk in zip(parts, chunks) if "error" not in part]
+    if not succeeded:
+        return parts[0]
+    weights = [estimate_tokens(chunk) for _, chunk in succeeded]
+    results = [part for part, _ in succeeded]
+    merged = merge_partial_values(results, weights)
+    merged["ai_source"] = results[0].get("ai_source")
+    merged["chunked_analysis"] = {"chunks": len(parts), "failed_chunks": len(parts) - len(succeeded)}
+    return merged
+
+async def run_cv_analysis(request: CVAnalysisRequest, on_stage: Optional[StageCallback] = None,
+                          analysis_id: str = None,
+                          shared_company_insights: Optional[asyncio.Future] = None,
+                          default_deadline_seconds: float = ANALYSIS_DEADLINE_SECONDS,
+                          max_deadline_seconds: float = ANALYSIS_MAX_DEADLINE_SECONDS) -> AnalysisResponse:
+    """Run the multi-AI and company pipelines for one CV, store the analysis and build the response
+
+    shared_company_insights, if given, is a future for company insights computed once for
+    several CVs (a batch); otherwise they are fetched for this request.
+    Stages still running at the deadline are cancelled and whatever finished is stored. The
+    deadline is the request's, else default_deadline_seconds, capped at max_deadline_seconds
+    (0 means no default or no cap).
+    """
+    analysis_id = analysis_id or str(uuid.uuid4())
+    deadline_seconds = request.deadline_seconds or default_deadline_seconds or None
+    if deadline_seconds and max_deadline_seconds:
+        deadline_seconds = min(deadline_seconds, max_deadline_seconds)
+    token = request_deadline.set(time.monotonic() + deadline_seconds if deadline_seconds else None)
+    try:
+        return await _run_cv_analysis(request, on_stage, analysis_id, shared_company_insights, deadline_seconds)
+    finally:
+        request_deadline.reset(token)
+
+async def _run_cv_analysis(request: CVAnalysisRequest, on_stage: Optional[StageCallback], analysis_id: str,
+                           shared_company_insights: Optional[asyncio.Future],
+                           deadline_seconds: Optional[float]) -> AnalysisResponse:
+    
+    # Only the normalized text is prompted; the original is kept with the stored analysis
+    cv_text, cv_preprocessing = normalize_cv_text(request.cv_text)
+    logger.info(
+        f"Normalized CV from {cv_preprocessing['tokens_before']} to "
+        f"{cv_preprocessing['tokens_after']} estimated tokens"
+    )
+    
+    # Upstream analyses that miss the ensemble quorum are attached to the stored analysis later
+    early_ensemble = (request.ensemble_quorum or ENSEMBLE_QUORUM) < 3 or ENSEMBLE_QUORUM_TIMEOUT_SECONDS > 0
+    stored = asyncio.Event()
+    
+    async def attach_late_result(stage: str, result: Any):
+        await stored.wait()
+        query = {"analysis_id": analysis_id}
+        await analyses_collection.update_one(query, {"$set": {
+            f"ai_results.{stage}": result,
+            f"stage_status.{stage}": stage_status(result)
+        }})
+        analysis = await analyses_collection.find_one(query, {"_id": 0})
+        if analysis:
+            partial = any(status != "completed" for status in analysis["stage_status"].values())
+            await analyses_collection.update_one(query, {"$set": {"partial": partial}})
+        logger.info(f"Attached late {stage} result to analysis {analysis_id}")
+    
+    # Multi-AI Analysis and Company Intelligence (if company specified) are
+    # independent, so both pipelines run concurrently
+    async def no_company_insights():
+        return None
+    
+    if shared_company_insights is not None:
+        company_pipeline = run_stage("company_insights", asyncio.shield(shared_company_insights), on_stage)
+    elif request.target_company:
+        company_pipeline = run_stage(
+            "company_insights",
+            company_intel.get_cached_intelligence(
+                request.target_company,
+                request.target_role,
+                force_refresh=request.bypass_cache
+            ),
+            on_stage
+        )
+    else:
+        company_pipeline = no_company_insights()
+    
+    ai_results, company_insights = await asyncio.gather(
+        ai_orchestrator.full_multi_ai_analysis(
+            cv_text, 
+            request.target_role,
+            use_cache=not request.bypass_cache,
+            on_stage=on_stage,
+            ensemble_mode=request.ensemble_mode,
+            deadline_seconds=deadline_seconds,
+            quorum=request.ensemble_quorum,
+            on_late_result=attach_late_result if early_ensemble else None,
+            tier=request.analysis_tier
+        ),
+        company_pipeline
+    )
+    
+    statuses = {
+        stage: stage_status(ai_results.get(stage))
+        for stage in ("gpt4_creative_analysis", "claude_strategic_analysis",
+                      "claude_skills_intelligence", "ai_ensemble_insights")
+    }
+    if request.target_company:
+        statuses["company_insights"] = stage_status(company_insights)
+    partial = any(status != "completed" for status in statuses.values())
+    
+    # Calculate ensemble confidence score; None when no ensemble produced one
+    ensemble_confidence = ai_results.get("ai_ensemble_insights", {}).get("ai_confidence")
+    if isinstance(ensemble_confidence, str):
+        try:
+            ensemble_confidence = float(re.findall(r'\d+\.?\d*', ensemble_confidence)[0])
+        except:
+            ensemble_confidence = None
+    if not isinstance(ensemble_confidence, (int, float)):
+        ensemble_confidence = None
+    
+    # Generate final recommendations
+    recommendations = [
+        "Optimize your CV based on AI analysis above",
+        "Focus on high-impact skill development",
+        "Tailor your application to company culture",
+        "Practice interview questions specific to this role"
+    ]
+    
+    # Store analysis in database
+    analysis_result = {
+        "analysis_id": analysis_id,
+        "timestamp": datetime.now(),
+        "cv_text": request.cv_text,
+        "target_role": request.target_role,
+        "target_company": request.target_company,
+        "ai_results": ai_results,
+        "company_insights": company_insights,
+        "confidence_score": ensemble_confidence,
+        "recommendations": recommendations,
+        "cv_preprocessing": cv_preprocessing,
+        "stage_status": statuses,
+        "partial": partial,
+        "deadline_seconds": deadline_seconds
+    }
+    
+    try:
+        await analyses_collection.insert_one(analysis_result)
+    finally:
+        stored.set()
+    
+    return AnalysisResponse(
+        analysis_id=analysis_id,
+        cv_improvements=ai_results.get("gpt4_creative_analysis", {}),
+        skills_analysis=ai_results.get("claude_skills_intelligence", {}),
+        company_insights=company_insights,
+        confidence_score=ensemble_confidence,
+        recommendations=recommendations,
+        cv_preprocessing=cv_preprocessing,
+        ai_results=ai_results,
+        stage_status=statuses,
+        partial=partial
+    )
+
+def apply_deadline_header(request: CVAnalysisRequest, deadline_header: Optional[str]):
+    """Take the time budget from the X-Request-Deadline header (seconds) unless the body sets one"""
+    if request.deadline_seconds is None and deadline_header:
+        try:
+            deadline = float(deadline_header)
+        except ValueError:
+            deadline = 0
+        if deadline <= 0:
+            raise HTTPException(status_code=400, detail="X-Request-Deadline must be a positive number of seconds")
+        request.deadline_seconds = deadline
+
 @app.post("/api/analyze-cv")
-async def analyze_cv(request: CVAnalysisRequest):
+async def analyze_cv(request: CVAnalysisRequest, x_request_deadline: Optional[str] = Header(None)):
     """Comprehensive CV analysis using Multi-AI Orchestration"""
+    apply_deadline_header(request, x_request_deadline)
     try:
-        analysis_id = str(uuid.uuid4())
+        return await run_cv_analysis(request)
         
-        # Multi-AI Analysis
-        ai_results = await ai_orchestrator.full_multi_ai_analysis(
-            request.cv_text, 
-            request.target_role
+    except Exception as e:
+        logger.error(f"CV analysis error: {e}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/api/analyze-cv/stream")
+async def analyze_cv_stream(request: CVAnalysisRequest, x_request_deadline: Optional[str] = Header(None)):
+    """Multi-AI CV analysis streamed as Server-Sent Events, one event per finished stage"""
+    apply_deadline_header(request, x_request_deadline)
+    started = time.monotonic()
+    events = asyncio.Queue()
+
+    async def on_stage(stage: str, result: Any, duration: float):
+        await events.put(format_sse("stage", {
+            "stage": stage,
+            "status": stage_status(result),
+            "result": result,
+            "duration_ms": round(duration * 1000),
+            "elapsed_ms": round((time.monotonic() - started) * 1000)
+        }))
+
+    async def run():
+        try:
+            response = await run_cv_analysis(request, on_stage=on_stage)
+            await events.put(format_sse("complete", {
+                "analysis_id": response.analysis_id,
+                "response": response.model_dump(),
+                "elapsed_ms": round((time.monotonic() - started) * 1000)
+            }))
+        except Exception as e:
+            logger.error(f"Streaming CV analysis error: {e}")
+            await events.put(format_sse("error", {"detail": f"Analysis failed: {str(e)}"}))
+        finally:
+            await events.put(None)
+
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                message = await events.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            # Stop paying for stages nobody will read once the client goes away
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Batch analysis: one role and company, many CVs, bounded across all batches in flight
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '200'))
+BATCH_MAX_CONCURRENT_ANALYSES = int(os.environ.get('BATCH_MAX_CONCURRENT_ANALYSES', '4'))
+batch_semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_ANALYSES)
+
+@app.post("/api/analyze-cv/batch")
+async def analyze_cv_batch(
+    files: List[UploadFile] = File(default=[]),
+    cv_texts: List[str] = Form(default=[]),
+    target_role: Optional[str] = Form(None),
+    target_company: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False),
+    ensemble_mode: Optional[Literal["llm", "local"]] = Form(None),
+    deadline_seconds: Optional[float] = Form(None, gt=0),
+    analysis_tier: Optional[Literal["auto", "fast", "standard", "deep"]] = Form(None)
+):
+    """Analyze many CVs against one role, streaming an event per item as Server-Sent Events
+
+    Company intelligence is fetched once for the batch. Items fail independently: a bad file
+    or analysis error is reported in its item event and the rest of the batch carries on.
+    """
+    total = len(files) + len(cv_texts)
+    if total == 0:
+        raise HTTPException(status_code=400, detail="Provide at least one CV as a file or text")
+    if total > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {BATCH_MAX_ITEMS} CVs")
+    
+    # Hash and size-check the uploads now; the form keeps their files open until the stream ends
+    items = []
+    for file in files:
+        try:
+            items.append({"source": file.filename, "upload": await SpooledUpload.from_upload(file),
+                          "content_type": file.content_type})
+        except UploadTooLarge as e:
+            items.append({"source": file.filename, "error": e.detail})
+    items.extend({"source": "text", "cv_text": text} for text in cv_texts)
+    
+    batch_id = str(uuid.uuid4())
+    started = time.monotonic()
+    events = asyncio.Queue()
+    counts = {"completed": 0, "failed": 0}
+    
+    def elapsed_ms():
+        return round((time.monotonic() - started) * 1000)
+    
+    async def fetch_company_insights():
+        insights = await company_intel.get_cached_intelligence(
+            target_company, target_role, force_refresh=bypass_cache
         )
-        
-        # Company Intelligence (if company specified)
-        company_insights = None
-        if request.target_company:
-            company_insights = await company_intel.get_comprehensive_intelligence(
-                request.target_company,
-                request.target_role
-            )
-        
-        # Calculate ensemble confidence score
-        ensemble_confidence = ai_results.get("ai_ensemble_insights", {}).get("ai_confidence", 85.0)
-        if isinstance(ensemble_confidence, str):
-            try:
-                ensemble_confidence = float(re.findall(r'\d+\.?\d*', ensemble_confidence)[0])
-            except:
-                ensemble_confidence = 85.0
-        
-        # Generate final recommendations
-        recommendations = [
-            "Optimize your CV based on AI analysis above",
-            "Focus on high-impact skill development",
-            "Tailor your application to company culture",
-            "Practice interview questions specific to this role"
-        ]
-        
-        # Store analysis in database
-        analysis_result = {
-            "analysis_id": analysis_id,
-            "timestamp": datetime.now(),
-            "cv_text": request.cv_text,
-            "target_role": request.target_role,
-            "target_company": request.target_company,
-            "ai_results": ai_results,
-            "company_insights": company_insights,
-            "confidence_score": ensemble_confidence,
-            "recommendations": recommendations
+        await events.put(format_sse("company", {
+            "batch_id": batch_id, "company_insights": insights, "elapsed_ms": elapsed_ms()
+        }))
+        return insights
+    
+    async def analyze_item(index: int, item: Dict[str, Any], company_insights: Optional[asyncio.Future]):
+        base = {"batch_id": batch_id, "index": index, "source": item["source"]}
+        try:
+            if "error" in item:
+                raise HTTPException(status_code=413, detail=item["error"])
+            async with batch_semaphore:
+                await events.put(format_sse("item", {**base, "status": "running", "elapsed_ms": elapsed_ms()}))
+                cv_text = item.get("cv_text")
+                if cv_text is None:
+                    extracted = await extract_spooled_cv(item["upload"], item["source"], item["content_type"])
+                    cv_text = extracted["cv_text"]
+                if not cv_text.strip():
+                    raise HTTPException(status_code=400, detail="CV text is empty")
+                request = CVAnalysisRequest(
+                    cv_text=cv_text,
+                    target_role=target_role,
+                    target_company=target_company,
+                    bypass_cache=bypass_cache,
+                    ensemble_mode=ensemble_mode,
+                    deadline_seconds=deadline_seconds,
+                    analysis_tier=analysis_tier
+                )
+                response = await run_cv_analysis(request, shared_company_insights=company_insights)
+            counts["completed"] += 1
+            await events.put(format_sse("item", {
+                **base, "status": "completed", "analysis_id": response.analysis_id,
+                "response": response.model_dump(), "elapsed_ms": elapsed_ms(), **counts
+            }))
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else f"Analysis failed: {str(e)}"
+            logger.error(f"Batch item {index} ({item['source']}) error: {detail}")
+            counts["failed"] += 1
+            await events.put(format_sse("item", {
+                **base, "status": "failed", "error": detail, "elapsed_ms": elapsed_ms(), **counts
+            }))
+    
+    async def run():
+        company_task = asyncio.create_task(fetch_company_insights()) if target_company else None
+        try:
+            await asyncio.gather(*[analyze_item(i, item, company_task) for i, item in enumerate(items)])
+            await events.put(format_sse("complete", {
+                "batch_id": batch_id, "total": total, **counts, "elapsed_ms": elapsed_ms()
+            }))
+        finally:
+            if company_task is not None and not company_task.done():
+                company_task.cancel()
+            await events.put(None)
+    
+    async def event_stream():
+        yield format_sse("accepted", {"batch_id": batch_id, "total": total})
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                message = await events.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            # Abandoned batches stop consuming analysis slots
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/analyze-cv/jobs", status_code=202)
+async def submit_analysis_job(request: AnalysisJobRequest):
+    """Queue a CV analysis and return immediately; poll /api/jobs/{job_id} for its status"""
+    try:
+        job = await job_queue.submit(request)
+        return {
+            "job_id": job["job_id"],
+            "analysis_id": job["analysis_id"],
+            "status": job["status"],
+            "status_url": f"/api/jobs/{job['job_id']}"
         }
         
-        analyses_collection.insert_one(analysis_result)
+    except Exception as e:
+        logger.error(f"Job submission error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue analysis: {str(e)}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a queued analysis job"""
+    try:
+        job = await job_queue.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
         
-        return AnalysisResponse(
-            analysis_id=analysis_id,
-            cv_improvements=ai_results.get("cv_analysis", {}),
-            skills_analysis=ai_results.get("skills_analysis", {}),
-            company_insights=company_insights,
-            confidence_score=ensemble_confidence,
-            recommendations=recommendations
-        )
+        return {
+            "job_id": job["job_id"],
+            "analysis_id": job["analysis_id"],
+            "status": job["status"],
+            "priority": job["priority"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "error": job["error"],
+            # As of completion; late quorum results are attached to the analysis itself
+            "partial": job.get("partial"),
+            "stage_status": job.get("stage_status"),
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "result_url": f"/api/analysis/{job['analysis_id']}" if job["status"] == "completed" else None
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"CV analysis error: {e}")
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+        logger.error(f"Get job error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve job: {str(e)}")
 
 @app.post("/api/company-research")
 async def research_company(request: CompanyResearchRequest):
     """Deep company research and intelligence"""
     try:
-        intelligence = await company_intel.get_comprehensive_intelligence(
+        # Served from companies_collection while fresh, refreshed and stored otherwise
+        intelligence = await company_intel.get_cached_intelligence(
             request.company_name,
-            request.role_type
-        )
-        
-        # Store in database
-        companies_collection.update_one(
-            {"company_name": request.company_name},
-            {"$set": {
-                "intelligence": intelligence,
-                "last_updated": datetime.now()
-            }},
-            upsert=True
+            request.role_type,
+            force_refresh=request.force_refresh
         )
         
         return intelligence
@@ -615,7 +3381,7 @@ async def research_company(request: CompanyResearchRequest):
 async def get_analysis(analysis_id: str):
     """Retrieve previous analysis"""
     try:
-        analysis = analyses_collection.find_one({"analysis_id": analysis_id})
+        analysis = await analyses_collection.find_one({"analysis_id": analysis_id})
         if not analysis:
             raise HTTPException(status_code=404, detail="Analysis not found")
         
@@ -623,6 +3389,8 @@ async def get_analysis(analysis_id: str):
         analysis["_id"] = str(analysis["_id"])
         return analysis
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Get analysis error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve analysis: {str(e)}")
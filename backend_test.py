@@ -416,6 +416,380 @@ class JobPrepAIBackendTests(unittest.TestCase):
         
         print("✅ Multi-AI Orchestration test passed - all AI models returning real results")
 
+    def test_12_cache_stats(self):
+        """Test LLM response cache counters and cache bypass"""
+        print("\n🔍 Testing LLM response cache stats...")
+        
+        response = requests.get(f"{self.api_url}/api/cache/stats")
+        self.assertEqual(response.status_code, 200, f"Cache stats failed with status {response.status_code}")
+        before = response.json()["llm_responses"]
+        for field in ["hits", "misses", "bypassed", "hit_rate"]:
+            self.assertTrue(field in before, f"Field '{field}' missing from cache stats")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "bypass_cache": True
+        }
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload)
+        self.assertEqual(response.status_code, 200, f"CV analysis failed with status {response.status_code}")
+        
+        stats = requests.get(f"{self.api_url}/api/cache/stats").json()
+        after = stats["llm_responses"]
+        self.assertGreater(after["bypassed"], before["bypassed"], "Cache bypass was not counted")
+        for provider, prefix_stats in stats["provider_prefix_cache"].items():
+            for field in ["requests", "hits", "cached_tokens", "hit_rate"]:
+                self.assertTrue(field in prefix_stats, f"Field '{field}' missing from {provider} prefix cache stats")
+        print("✅ Cache stats test passed")
+
+    def test_13_analyze_cv_stream(self):
+        """Test Server-Sent Events streaming of per-stage analysis results"""
+        print("\n🔍 Testing streaming CV analysis...")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "target_company": self.sample_company
+        }
+        
+        stages = []
+        complete = None
+        with requests.post(f"{self.api_url}/api/analyze-cv/stream", json=payload, stream=True) as response:
+            self.assertEqual(response.status_code, 200, f"Streaming analysis failed with status {response.status_code}")
+            self.assertTrue(response.headers["content-type"].startswith("text/event-stream"), "Response is not an event stream")
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    self.assertNotEqual(event, "error", f"Stream reported an error: {data}")
+                    if event == "stage":
+                        self.assertTrue("duration_ms" in data, "Stage event missing timing")
+                        stages.append(data["stage"])
+                    elif event == "complete":
+                        complete = data
+        
+        for stage in ["gpt4_creative_analysis", "claude_strategic_analysis", "claude_skills_intelligence",
+                      "ai_ensemble_insights", "company_insights"]:
+            self.assertTrue(stage in stages, f"Stage '{stage}' was not streamed")
+        self.assertIsNotNone(complete, "Final event not received")
+        for stage in ["gpt4_creative_analysis", "claude_strategic_analysis", "claude_skills_intelligence"]:
+            self.assertLess(stages.index(stage), stages.index("ai_ensemble_insights"),
+                            f"Ensemble was streamed before '{stage}'")
+        
+        response = requests.get(f"{self.api_url}/api/analysis/{complete['analysis_id']}")
+        self.assertEqual(response.status_code, 200, "Streamed analysis was not persisted")
+        print("✅ Streaming analysis test passed")
+
+    def test_14_analysis_job(self):
+        """Test queued analysis jobs with status polling"""
+        print("\n🔍 Testing analysis job queue...")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "priority": 1
+        }
+        response = requests.post(f"{self.api_url}/api/analyze-cv/jobs", json=payload)
+        self.assertEqual(response.status_code, 202, f"Job submission failed with status {response.status_code}")
+        job = response.json()
+        for field in ["job_id", "analysis_id", "status"]:
+            self.assertTrue(field in job, f"Field '{field}' missing from job submission response")
+        
+        # Poll until the workers have finished the analysis
+        status = job["status"]
+        for _ in range(60):
+            response = requests.get(f"{self.api_url}/api/jobs/{job['job_id']}")
+            self.assertEqual(response.status_code, 200, f"Job status failed with status {response.status_code}")
+            job_status = response.json()
+            status = job_status["status"]
+            if status in ("completed", "failed"):
+                break
+            time.sleep(5)
+        
+        self.assertEqual(status, "completed", f"Job did not complete, last status: {status}")
+        # A job that ran out of time still completes, but says which stages are missing
+        self.assertTrue(isinstance(job_status["partial"], bool), "Completed job should report whether it is partial")
+        self.assertTrue(job_status["stage_status"], "Completed job should report its stage statuses")
+        response = requests.get(f"{self.api_url}/api/analysis/{job['analysis_id']}")
+        self.assertEqual(response.status_code, 200, "Job result could not be fetched by analysis_id")
+        
+        response = requests.get(f"{self.api_url}/api/jobs/does-not-exist")
+        self.assertEqual(response.status_code, 404, "Unknown job should return 404")
+        print("✅ Analysis job test passed")
+
+    def test_15_repeat_upload_cache_hit(self):
+        """Test that re-uploading the same file is served from the extracted-text cache"""
+        print("\n🔍 Testing extracted-text cache on repeat upload...")
+        
+        docx_file = BytesIO()
+        with zipfile.ZipFile(docx_file, 'w') as zf:
+            zf.writestr('[Content_Types].xml', '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="xml" ContentType="application/xml"/><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+            zf.writestr('_rels/.rels', '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+            zf.writestr('word/document.xml', f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body><w:p><w:r><w:t>Cache test CV {time.time()}</w:t></w:r></w:p></w:body></w:document>')
+            zf.writestr('word/_rels/document.xml.rels', '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"></Relationships>')
+        content = docx_file.getvalue()
+        mime = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        
+        first = requests.post(f"{self.api_url}/api/upload-cv", files={'file': ('cache_cv.docx', BytesIO(content), mime)})
+        self.assertEqual(first.status_code, 200, f"First upload failed with status {first.status_code}")
+        self.assertFalse(first.json()["cache_hit"], "First upload of a new file should not be a cache hit")
+        
+        second = requests.post(f"{self.api_url}/api/upload-cv", files={'file': ('cache_cv.docx', BytesIO(content), mime)})
+        self.assertEqual(second.status_code, 200, f"Repeat upload failed with status {second.status_code}")
+        self.assertTrue(second.json()["cache_hit"], "Repeat upload should be served from the cache")
+        self.assertEqual(first.json()["cv_text"], second.json()["cv_text"], "Cached text differs from extracted text")
+        print("✅ Extracted-text cache test passed")
+
+    def test_16_local_ensemble(self):
+        """Test that the local ensemble engine returns the ensemble schema without a model call"""
+        print("\n🔍 Testing local ensemble mode...")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "ensemble_mode": "local"
+        }
+        
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload)
+        self.assertEqual(response.status_code, 200, f"Local ensemble analysis failed with status {response.status_code}")
+        response = requests.get(f"{self.api_url}/api/analysis/{response.json()['analysis_id']}")
+        self.assertEqual(response.status_code, 200, f"Analysis retrieval failed with status {response.status_code}")
+        ensemble = response.json()["ai_results"]["ai_ensemble_insights"]
+        self.assertEqual(ensemble.get("ai_source"), "Local Ensemble Engine", "Ensemble was not computed locally")
+        for key in ["consensus_score", "ai_agreement_areas", "ai_disagreement_areas", "unified_priorities", "ai_confidence"]:
+            self.assertTrue(key in ensemble, f"Local ensemble missing '{key}'")
+        
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json={**payload, "ensemble_mode": "unknown"})
+        self.assertEqual(response.status_code, 422, "Unknown ensemble mode should be rejected")
+        print("✅ Local ensemble test passed")
+
+    def test_17_batch_analysis(self):
+        """Test batch analysis streams one result per CV and isolates per-item failures"""
+        print("\n🔍 Testing batch CV analysis...")
+        
+        files = [
+            ('files', ('candidate_a.txt', BytesIO(self.sample_cv_text.encode('utf-8')), 'text/plain')),
+            ('files', ('empty.txt', BytesIO(b'   '), 'text/plain'))
+        ]
+        data = {
+            "cv_texts": [self.sample_cv_text],
+            "target_role": self.sample_role,
+            "target_company": self.sample_company,
+            "ensemble_mode": "local"
+        }
+        
+        results = {}
+        company_events = 0
+        complete = None
+        with requests.post(f"{self.api_url}/api/analyze-cv/batch", files=files, data=data, stream=True) as response:
+            self.assertEqual(response.status_code, 200, f"Batch analysis failed with status {response.status_code}")
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    payload = json.loads(line[len("data: "):])
+                    if event == "item" and payload["status"] != "running":
+                        results[payload["index"]] = payload
+                    elif event == "company":
+                        company_events += 1
+                    elif event == "complete":
+                        complete = payload
+        
+        self.assertIsNotNone(complete, "Batch completion event not received")
+        self.assertEqual(company_events, 1, "Company intelligence should be computed once per batch")
+        self.assertEqual(results[0]["status"], "completed", f"File item failed: {results[0].get('error')}")
+        self.assertEqual(results[1]["status"], "failed", "Empty file should fail without failing the batch")
+        self.assertEqual(results[2]["status"], "completed", f"Text item failed: {results[2].get('error')}")
+        self.assertEqual((complete["completed"], complete["failed"]), (2, 1), "Batch summary counts are wrong")
+        print("✅ Batch analysis test passed")
+
+    def test_18_provider_status(self):
+        """Test the per-provider rate limiter status endpoint"""
+        print("\n🔍 Testing provider status...")
+        
+        response = requests.get(f"{self.api_url}/api/providers/status")
+        self.assertEqual(response.status_code, 200, f"Provider status failed with status {response.status_code}")
+        data = response.json()
+        for provider in ["openai", "anthropic"]:
+            self.assertTrue(provider in data["rate_limits"], f"Provider '{provider}' missing from status")
+            for key in ["calls", "rate_limited", "retries", "concurrency_limit", "tokens_available"]:
+                self.assertTrue(key in data["rate_limits"][provider], f"'{key}' missing from {provider} status")
+        for role in ["creative", "strategic", "skills", "ensemble"]:
+            self.assertTrue(role in data["routes"], f"No routes for role '{role}'")
+            for route in data["routes"][role]:
+                self.assertTrue(data["models"][route]["state"] in ("closed", "open", "half_open"),
+                                f"Unexpected circuit state for {route}")
+        self.assertTrue("by_role" in data["hedging"], "Hedging counters missing from status")
+        print("✅ Provider status test passed")
+
+    def test_19_fake_provider_fault_injection(self):
+        """Test that the fake provider accepts injected latency and failures when enabled"""
+        print("\n🔍 Testing fake provider fault injection...")
+        
+        response = requests.post(f"{self.api_url}/api/providers/fake",
+                                 json={"model": "flaky", "latency_seconds": 0.1, "failure_rate": 1.0})
+        if response.status_code == 404:
+            self.skipTest("Fake provider is not enabled on this server (FAKE_PROVIDER_ENABLED)")
+        self.assertEqual(response.status_code, 200, f"Fault injection failed with status {response.status_code}")
+        self.assertEqual(response.json()["failure_rate"], 1.0, "Failure rate was not applied")
+        
+        response = requests.post(f"{self.api_url}/api/providers/fake", json={"model": "flaky"})
+        self.assertEqual(response.status_code, 200, "Resetting injected faults failed")
+        print("✅ Fake provider fault injection test passed")
+
+    def test_20_request_deadline(self):
+        """Test that a request deadline returns and stores partial results with per-stage status"""
+        print("\n🔍 Testing request deadline with partial results...")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "bypass_cache": True
+        }
+        
+        started = time.time()
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload, headers={"X-Request-Deadline": "1"})
+        elapsed = time.time() - started
+        self.assertEqual(response.status_code, 200, f"Deadline analysis failed with status {response.status_code}")
+        data = response.json()
+        self.assertLess(elapsed, 10, f"Request ran {elapsed:.1f}s past a 1s deadline")
+        for stage, status in data["stage_status"].items():
+            self.assertTrue(status in ("completed", "failed", "timed_out"), f"Unexpected status '{status}' for {stage}")
+        self.assertEqual(data["partial"], any(s != "completed" for s in data["stage_status"].values()),
+                         "Partial flag does not match stage statuses")
+        
+        stored = requests.get(f"{self.api_url}/api/analysis/{data['analysis_id']}").json()
+        self.assertEqual(stored["stage_status"], data["stage_status"], "Stage statuses were not stored")
+        
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload, headers={"X-Request-Deadline": "soon"})
+        self.assertEqual(response.status_code, 400, "Invalid deadline header should be rejected")
+        print("✅ Request deadline test passed")
+
+    def test_21_quorum_ensemble(self):
+        """Test that a quorum ensemble reports its inputs and late results are attached afterwards"""
+        print("\n🔍 Testing early-quorum ensemble...")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "bypass_cache": True,
+            "ensemble_quorum": 2
+        }
+        
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload)
+        self.assertEqual(response.status_code, 200, f"Quorum analysis failed with status {response.status_code}")
+        data = response.json()
+        ensemble_inputs = data["ai_results"]["ensemble_inputs"]
+        self.assertGreaterEqual(len(ensemble_inputs), 1, "Ensemble reported no inputs")
+        for stage in ensemble_inputs:
+            self.assertEqual(data["stage_status"][stage], "completed", f"Ensemble input '{stage}' did not complete")
+        
+        # Upstream analyses that missed the quorum are attached to the stored analysis when they land
+        pending = [stage for stage, status in data["stage_status"].items() if status == "pending"]
+        deadline = time.time() + 180
+        while pending and time.time() < deadline:
+            time.sleep(2)
+            stored = requests.get(f"{self.api_url}/api/analysis/{data['analysis_id']}").json()
+            pending = [stage for stage, status in stored["stage_status"].items() if status == "pending"]
+        self.assertEqual(pending, [], f"Late results were never attached: {pending}")
+        print("✅ Quorum ensemble test passed")
+
+    def test_22_fast_tier(self):
+        """Test that the fast tier fills the standard response shape from a single combined call"""
+        print("\n🔍 Testing fast analysis tier...")
+        
+        payload = {
+            "cv_text": self.sample_cv_text,
+            "target_role": self.sample_role,
+            "analysis_tier": "fast"
+        }
+        
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload)
+        self.assertEqual(response.status_code, 200, f"Fast tier analysis failed with status {response.status_code}")
+        data = response.json()
+        self.assertEqual(data["ai_results"]["analysis_tier"], "fast", "Fast tier was not used")
+        required_fields = ["analysis_id", "cv_improvements", "skills_analysis", "confidence_score", "recommendations"]
+        for field in required_fields:
+            self.assertTrue(field in data, f"Field '{field}' missing from fast tier response")
+        for stage in ["gpt4_creative_analysis", "claude_strategic_analysis", "claude_skills_intelligence", "ai_ensemble_insights"]:
+            self.assertTrue(stage in data["stage_status"], f"Stage '{stage}' missing from fast tier response")
+        self.assertEqual(data["ai_results"]["ai_ensemble_insights"].get("ai_source"), "Local Ensemble Engine",
+                         "Fast tier should not make a separate ensemble call")
+        print("✅ Fast tier test passed")
+
+    def test_23_page_boilerplate_only(self):
+        """Test that only running page headers/footers are dropped, not repeated CV content"""
+        print("\n🔍 Testing page boilerplate removal...")
+        
+        page_one = "\n".join([
+            "JOHN DOE - Curriculum Vitae",
+            "EXPERIENCE",
+            "Senior Software Engineer | Tech Company Inc.",
+            "2020 - 2023",
+            "Responsibilities:",
+            "- Led development of microservices",
+            "Key achievements:",
+            "- Reduced deployment time by 40%",
+            "Page 1 of 2"
+        ])
+        page_two = "\n".join([
+            "JOHN DOE - Curriculum Vitae",
+            "Software Developer | StartupXYZ",
+            "2017 - 2020",
+            "Responsibilities:",
+            "- Led development of microservices",
+            "Key achievements:",
+            "- Increased code coverage by 30%",
+            "Page 2 of 2"
+        ])
+        payload = {
+            "cv_text": page_one + "\f" + page_two,
+            "target_role": self.sample_role,
+            "analysis_tier": "fast",
+            "bypass_cache": True
+        }
+        
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload)
+        self.assertEqual(response.status_code, 200, f"Analysis failed with status {response.status_code}")
+        preprocessing = response.json()["cv_preprocessing"]
+        # The second header and both page footers; headings, bullets and date ranges all stay
+        self.assertEqual(preprocessing["boilerplate_lines_removed"], 3,
+                         f"Unexpected lines removed: {preprocessing}")
+        print("✅ Page boilerplate test passed")
+
+    def test_24_prefix_cache_staggering(self):
+        """Test that one analysis writes the shared CV prefix once and later calls read it"""
+        print("\n🔍 Testing prompt prefix cache staggering...")
+        
+        routes = requests.get(f"{self.api_url}/api/providers/status").json()["routes"]
+        if any(not routes[role][0].startswith("fake:") for role in ["creative", "strategic", "skills"]):
+            self.skipTest("Upstream analyses are not routed to the fake provider on this server")
+        for role in ["creative", "strategic", "skills"]:
+            requests.post(f"{self.api_url}/api/providers/fake",
+                          json={"model": routes[role][0].split(":", 1)[1], "latency_seconds": 0.3})
+        
+        before = requests.get(f"{self.api_url}/api/cache/stats").json()["provider_prefix_cache"].get("fake", {})
+        payload = {
+            "cv_text": f"{self.sample_cv_text}\nReference: {time.time()}",
+            "target_role": self.sample_role,
+            "bypass_cache": True
+        }
+        response = requests.post(f"{self.api_url}/api/analyze-cv", json=payload)
+        self.assertEqual(response.status_code, 200, f"CV analysis failed with status {response.status_code}")
+        after = requests.get(f"{self.api_url}/api/cache/stats").json()["provider_prefix_cache"]["fake"]
+        
+        delta = {key: after[key] - before.get(key, 0) for key in ["hits", "cached_tokens", "cache_write_tokens"]}
+        # The first upstream call writes the prefix; the other two start after it and hit it
+        self.assertEqual(delta["hits"], 2, f"Expected 2 prefix cache hits, got {delta}")
+        self.assertGreater(delta["cache_write_tokens"], 0, "The CV prefix was never written")
+        # Both hits read exactly what the single write stored, so the prefix was byte-identical
+        self.assertEqual(delta["cached_tokens"], 2 * delta["cache_write_tokens"],
+                         f"Hits did not read the written prefix: {delta}")
+        print("✅ Prefix cache staggering test passed")
+
 if __name__ == "__main__":
     # Run the tests
     print("🚀 Starting JobPrep AI Backend Tests")
@@ -434,6 +808,19 @@ if __name__ == "__main__":
     suite.addTest(JobPrepAIBackendTests('test_09_company_research'))
     suite.addTest(JobPrepAIBackendTests('test_10_get_analysis'))
     suite.addTest(JobPrepAIBackendTests('test_11_multi_ai_orchestration'))
+    suite.addTest(JobPrepAIBackendTests('test_12_cache_stats'))
+    suite.addTest(JobPrepAIBackendTests('test_13_analyze_cv_stream'))
+    suite.addTest(JobPrepAIBackendTests('test_14_analysis_job'))
+    suite.addTest(JobPrepAIBackendTests('test_15_repeat_upload_cache_hit'))
+    suite.addTest(JobPrepAIBackendTests('test_16_local_ensemble'))
+    suite.addTest(JobPrepAIBackendTests('test_17_batch_analysis'))
+    suite.addTest(JobPrepAIBackendTests('test_18_provider_status'))
+    suite.addTest(JobPrepAIBackendTests('test_19_fake_provider_fault_injection'))
+    suite.addTest(JobPrepAIBackendTests('test_20_request_deadline'))
+    suite.addTest(JobPrepAIBackendTests('test_21_quorum_ensemble'))
+    suite.addTest(JobPrepAIBackendTests('test_22_fast_tier'))
+    suite.addTest(JobPrepAIBackendTests('test_23_page_boilerplate_only'))
+    suite.addTest(JobPrepAIBackendTests('test_24_prefix_cache_staggering'))
     
     runner = unittest.TextTestRunner(verbosity=2)
     result = runner.run(suite)
@@ -161,10 +161,10 @@ function App() {
             <div className="score-bar">
               <div 
                 className="score-fill" 
-                style={{ width: `${analysis.confidence_score}%` }}
+                style={{ width: `${analysis.confidence_score ?? 0}%` }}
               ></div>
             </div>
-            <span>{Math.round(analysis.confidence_score)}%</span>
+            <span>{analysis.confidence_score == null ? 'n/a' : `${Math.round(analysis.confidence_score)}%`}</span>
           </div>
         </div>
 